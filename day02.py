@@ -63,15 +63,75 @@ def run_program(puzzle_input: List[int]) -> Program:
     return program
 
 
+def run_lockstep(memory: List[List[int]]) -> List[List[int]]:
+    # Runs many copies (lanes) of a program side by side. memory[address]
+    # holds the value of that address for every lane, so every instruction is
+    # decoded once and carried out for all lanes together. Lanes that end up
+    # at different instructions are split into separate groups. Returns the
+    # memory of all halted lanes, laid out the same way.
+    lane_count = len(memory[0])
+    halted = None
+    groups = [(list(range(lane_count)), memory, 0)]
+    while groups:
+        lanes, memory, pointer = groups.pop()
+        while True:
+            opcodes = memory[pointer]
+            if opcodes.count(opcodes[0]) != len(opcodes):
+                split = {}
+                for index, opcode in enumerate(opcodes):
+                    split.setdefault(opcode, []).append(index)
+                for indices in split.values():
+                    groups.append(
+                        (
+                            [lanes[index] for index in indices],
+                            [[column[index] for index in indices] for column in memory],
+                            pointer,
+                        )
+                    )
+                break
+            opcode = opcodes[0]
+            if opcode not in valid_opcodes:
+                raise ValueError(f"Invalid opcode {opcode}")
+            if opcode == 99:
+                if len(lanes) == lane_count:
+                    return memory
+                if halted is None:
+                    halted = [[0] * lane_count for _ in memory]
+                for column, values in zip(halted, memory):
+                    for index, lane in enumerate(lanes):
+                        column[lane] = values[index]
+                break
+            first, second, third = memory[pointer + 1 : pointer + 4]
+            if first.count(first[0]) == len(first):
+                first = memory[first[0]]
+            else:
+                first = [memory[address][i] for i, address in enumerate(first)]
+            if second.count(second[0]) == len(second):
+                second = memory[second[0]]
+            else:
+                second = [memory[address][i] for i, address in enumerate(second)]
+            if opcode == 1:
+                values = [x + y for x, y in zip(first, second)]
+            else:
+                values = [x * y for x, y in zip(first, second)]
+            if third.count(third[0]) == len(third):
+                memory[third[0]] = values
+            else:
+                for i, address in enumerate(third):
+                    memory[address][i] = values[i]
+            pointer += 4
+    return halted
+
+
 def check_for_specific_output(puzzle_input=List[int]) -> Program:
-    for noun in range(100):
-        for verb in range(100):
-            new_puzzle_input = puzzle_input.copy()
-            new_puzzle_input[1] = noun
-            new_puzzle_input[2] = verb
-            new_program = run_program(new_puzzle_input)
-            if new_program.array[0] == 19690720:
-                return noun, verb
+    # All 10000 noun/verb pairs run at once, see run_lockstep.
+    pairs = [(noun, verb) for noun in range(100) for verb in range(100)]
+    memory = [[value] * len(pairs) for value in puzzle_input]
+    memory[1] = [noun for noun, verb in pairs]
+    memory[2] = [verb for noun, verb in pairs]
+    for (noun, verb), result in zip(pairs, run_lockstep(memory)[0]):
+        if result == 19690720:
+            return noun, verb
 
 
 if __name__ == "__main__":
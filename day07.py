@@ -1,6 +1,7 @@
 import itertools
 import sys
-from typing import List, NamedTuple
+from collections import deque
+from typing import Generator, List, NamedTuple
 
 #################### INTCODE COMPUTER ############################
 valid_opcodes = [1, 2, 3, 4, 5, 6, 7, 8, 99]
@@ -10,164 +11,139 @@ class Program:
     def __init__(self, array: List[int], pointer: int, inputs: List[int]):
         self.array = array
         self.pointer = pointer
-        self.inputs = inputs
+        self.inputs = deque(inputs)
         self.output = []
 
+    def push_input(self, value: int) -> None:
+        self.inputs.append(value)
+
+    def extend_inputs(self, values: List[int]) -> None:
+        self.inputs.extend(values)
+
 
 mode_lengths = {1: 3, 2: 3, 3: 1, 4: 1, 5: 2, 6: 2, 7: 3, 8: 3, 99: 0}
 
 
+# Parsed instructions, keyed by the raw value. The same few hundred values are
+# executed over and over, so every one is only parsed (and checked) once.
+decoded_instructions = {}
+
+
 def parse_modes(value: int) -> (int, List[int]):
+    if value in decoded_instructions:
+        return decoded_instructions[value]
     opcode = int(str(value)[-2:])
+    if opcode not in valid_opcodes:
+        raise ValueError(f"Invalid opcode {opcode}")
     modes = [int(val) for val in str(value)[:-2]]
     for i in range(mode_lengths[opcode] - len(modes)):
         modes.insert(0, 0)
-    return opcode, modes[::-1]
-
-
-def use_mode(array: List[int], pointer: int, mode: int) -> int:
-    if mode == 0:
-        return array[array[pointer]]
-    elif mode == 1:
-        return array[pointer]
-    else:
-        raise ValueError(f"Wrong mode {modes[0]}")
-
-
-def opcode_1(program: Program, modes: List[int]) -> Program:
-    pointer = program.pointer
-    array = program.array
-    first_param = use_mode(array, pointer + 1, modes[0])
-    second_param = use_mode(array, pointer + 2, modes[1])
-    result_sum = first_param + second_param
-    program.array[array[pointer + 3]] = result_sum
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_2(program: Program, modes: List[int]) -> Program:
-    pointer = program.pointer
-    array = program.array
-    first_param = use_mode(array, pointer + 1, modes[0])
-    second_param = use_mode(array, pointer + 2, modes[1])
-    result_sum = first_param * second_param
-    program.array[array[pointer + 3]] = result_sum
-    program.pointer = pointer + 4
-    return program
+    modes = modes[::-1]
+    if any(mode not in [0, 1] for mode in modes[: mode_lengths[opcode]]):
+        raise ValueError(f"Wrong mode in instruction {value}")
+    decoded_instructions[value] = opcode, modes
+    return decoded_instructions[value]
 
 
-def opcode_3(program: Program) -> Program:
-    pointer = program.pointer
-    array = program.array
-    current_input = program.inputs.pop(0)
-    program.array[array[pointer + 1]] = current_input
-    program.pointer = program.pointer + 2
-    return program
+def initiate_program(puzzle_input: List[int], input_list: List[int]) -> Program:
+    return Program(array=puzzle_input, pointer=0, inputs=input_list)
 
 
-def opcode_4(program: Program, modes: List[int]) -> Program:
-    pointer = program.pointer
+def continue_program_till_output_or_halt(program: Program, last_step: int) -> Program:
+    # The whole interpreter lives in this one loop: pointer and memory are kept
+    # in locals and only written back to the program when it halts or outputs.
+    # Every parameter is resolved to an address, so immediate parameters just
+    # point at the instruction itself.
+    if last_step == 99:
+        return program, last_step
     array = program.array
-    param = use_mode(array, pointer + 1, modes[0])
-    program.output.append(param)
-    program.pointer = pointer + 2
-    return program
-
-
-def opcode_5(program: Program, modes: List[int]) -> Program:
     pointer = program.pointer
-    array = program.array
-    first_param = use_mode(array, pointer + 1, modes[0])
-    second_param = use_mode(array, pointer + 2, modes[1])
-    if first_param != 0:
-        program.pointer = second_param
-    else:
-        program.pointer = pointer + 3
-    return program
+    while True:
+        opcode, modes = parse_modes(array[pointer])
+        if opcode == 99:
+            last_step = 99
+            break
+
+        first = array[pointer + 1] if modes[0] == 0 else pointer + 1
+        if opcode == 3:
+            array[first] = program.inputs.popleft()
+            pointer += 2
+            continue
+        if opcode == 4:
+            program.output.append(array[first])
+            pointer += 2
+            last_step = 4
+            break
+
+        second = array[pointer + 2] if modes[1] == 0 else pointer + 2
+        if opcode == 5:
+            pointer = array[second] if array[first] != 0 else pointer + 3
+            continue
+        if opcode == 6:
+            pointer = array[second] if array[first] == 0 else pointer + 3
+            continue
+
+        third = array[pointer + 3]
+        if opcode == 1:
+            array[third] = array[first] + array[second]
+        elif opcode == 2:
+            array[third] = array[first] * array[second]
+        elif opcode == 7:
+            array[third] = 1 if array[first] < array[second] else 0
+        else:
+            array[third] = 1 if array[first] == array[second] else 0
+        pointer += 4
+    program.pointer = pointer
+    return program, last_step
 
 
-def opcode_6(program: Program, modes: List[int]) -> Program:
-    pointer = program.pointer
+def run_as_generator(program: Program) -> Generator[int, int, None]:
+    # The program as a coroutine: every output is yielded, and a value passed
+    # in with send() is queued as input. When the program needs an input it
+    # does not have yet, it yields None. Prime it with next() first.
     array = program.array
-    first_param = use_mode(array, pointer + 1, modes[0])
-    second_param = use_mode(array, pointer + 2, modes[1])
-    if first_param == 0:
-        program.pointer = second_param
-    else:
-        program.pointer = pointer + 3
-    return program
-
-
-def opcode_7(program: Program, modes: List[int]) -> Program:
+    inputs = program.inputs
     pointer = program.pointer
-    array = program.array
-    first_param = use_mode(array, pointer + 1, modes[0])
-    second_param = use_mode(array, pointer + 2, modes[1])
-    if first_param < second_param:
-        program.array[array[pointer + 3]] = 1
-    else:
-        program.array[array[pointer + 3]] = 0
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_8(program: Program, modes: List[int]) -> Program:
-    pointer = program.pointer
-    array = program.array
-    first_param = use_mode(array, pointer + 1, modes[0])
-    second_param = use_mode(array, pointer + 2, modes[1])
-    if first_param == second_param:
-        program.array[array[pointer + 3]] = 1
-    else:
-        program.array[array[pointer + 3]] = 0
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_99(program: Program) -> Program:
-    return program
-
-
-def do_step(program: Program) -> (Program, bool):
-    opcode, modes = parse_modes(program.array[program.pointer])
-    if opcode not in valid_opcodes:
-        print(
-            program.pointer,
-            program.array,
-            program.array[program.pointer - 5 : program.pointer + 5],
-        )
-        raise ValueError(f"Invalid opcode {opcode}")
-    if opcode == 1:
-        new_program = opcode_1(program, modes)
-        return new_program, opcode
-    if opcode == 2:
-        new_program = opcode_2(program, modes)
-        return new_program, opcode
-    if opcode == 3:
-        new_program = opcode_3(program)
-        return new_program, opcode
-    if opcode == 4:
-        new_program = opcode_4(program, modes)
-        return new_program, opcode
-    if opcode == 5:
-        new_program = opcode_5(program, modes)
-        return new_program, opcode
-    if opcode == 6:
-        new_program = opcode_6(program, modes)
-        return new_program, opcode
-    if opcode == 7:
-        new_program = opcode_7(program, modes)
-        return new_program, opcode
-    if opcode == 8:
-        new_program = opcode_8(program, modes)
-        return new_program, opcode
-    if opcode == 99:
-        new_program = opcode_99(program)
-        return new_program, opcode
-
-
-def initiate_program(puzzle_input: List[int], input_list: List[int]) -> Program:
-    return Program(array=puzzle_input, pointer=0, inputs=input_list)
+    while True:
+        opcode, modes = parse_modes(array[pointer])
+        if opcode == 99:
+            program.pointer = pointer
+            return
+
+        first = array[pointer + 1] if modes[0] == 0 else pointer + 1
+        if opcode == 3:
+            while not inputs:
+                received = yield None
+                if received is not None:
+                    inputs.append(received)
+            array[first] = inputs.popleft()
+            pointer += 2
+            continue
+        if opcode == 4:
+            received = yield array[first]
+            if received is not None:
+                inputs.append(received)
+            pointer += 2
+            continue
+
+        second = array[pointer + 2] if modes[1] == 0 else pointer + 2
+        if opcode == 5:
+            pointer = array[second] if array[first] != 0 else pointer + 3
+            continue
+        if opcode == 6:
+            pointer = array[second] if array[first] == 0 else pointer + 3
+            continue
+
+        third = array[pointer + 3]
+        if opcode == 1:
+            array[third] = array[first] + array[second]
+        elif opcode == 2:
+            array[third] = array[first] * array[second]
+        elif opcode == 7:
+            array[third] = 1 if array[first] < array[second] else 0
+        else:
+            array[third] = 1 if array[first] == array[second] else 0
+        pointer += 4
 
 
 ####################################################################
@@ -177,18 +153,10 @@ def run_program(puzzle_input: List[int], input_list: List[int]) -> Program:
     program = initiate_program(puzzle_input, input_list)
     last_step = 0
     while last_step != 99:
-        program, last_step = do_step(program)
+        program, last_step = continue_program_till_output_or_halt(program, last_step)
     return program
 
 
-def continue_program_till_output_or_halt(program: Program, last_step: int) -> Program:
-    if last_step != 99:
-        last_step = 0
-    while (last_step != 4) and (last_step != 99):
-        program, last_step = do_step(program)
-    return program, last_step
-
-
 def calculate_thrusting_no_feedback(
     puzzle_input: List[int], sequence: List[int]
 ) -> int:
@@ -208,33 +176,27 @@ def get_max_thrusting_part1(puzzle_input: List[int]) -> int:
     )
 
 
+def start_amplifier(puzzle_input: List[int], phase: int) -> Generator[int, int, None]:
+    # Every amplifier gets its own copy of the memory.
+    amplifier = run_as_generator(initiate_program(list(puzzle_input), [phase]))
+    next(amplifier)
+    return amplifier
+
+
 def calculate_thrusting_feedback(puzzle_input: List[int], sequence: List[int]) -> int:
     thrustings = []
     for seq in sequence:
-        amp_a = initiate_program(puzzle_input, [seq[0], 0])
-        amp_b = initiate_program(puzzle_input, [seq[1]])
-        amp_c = initiate_program(puzzle_input, [seq[2]])
-        amp_d = initiate_program(puzzle_input, [seq[3]])
-        amp_e = initiate_program(puzzle_input, [seq[4]])
-        amps = [amp_a, amp_b, amp_c, amp_d, amp_e]
-        last_steps = [0, 0, 0, 0, 0]
-        connections = [1, 2, 3, 4, 0]
-
-        i = 0
-        current_amp = 0
-        all_halt = False
-        while not all_halt:
-            (
-                amps[current_amp],
-                last_steps[current_amp],
-            ) = continue_program_till_output_or_halt(
-                amps[current_amp], last_steps[current_amp]
-            )
-            amps[connections[current_amp]].inputs.append(amps[current_amp].output[-1])
-            all_halt = all([last_step == 99 for last_step in last_steps])
-
-            current_amp = connections[current_amp]
-        thrustings.append(amps[4].output[-1])
+        amps = [start_amplifier(puzzle_input, phase) for phase in seq]
+        # Every signal is sent into an amplifier, which answers with its next
+        # output. Once amplifier A halts, E's last output is the thrust.
+        signal = 0
+        try:
+            while True:
+                for amp in amps:
+                    signal = amp.send(signal)
+                thrust = signal
+        except StopIteration:
+            thrustings.append(thrust)
     return thrustings
 
 
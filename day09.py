@@ -1,5 +1,6 @@
 import itertools
 import sys
+from collections import deque
 from typing import List, NamedTuple
 
 #################### INTCODE COMPUTER ############################
@@ -7,6 +8,9 @@ valid_opcodes = [1, 2, 3, 4, 5, 6, 7, 8, 9, 99]
 
 mode_lengths = {1: 3, 2: 3, 3: 1, 4: 1, 5: 2, 6: 2, 7: 3, 8: 3, 9: 1, 99: 0}
 
+# Opcodes whose last parameter is the address that gets written to.
+writing_opcodes = [1, 2, 3, 7, 8]
+
 
 class Program:
     def __init__(
@@ -19,204 +23,65 @@ class Program:
     ):
         self.array = array + [0] * extra_memory
         self.pointer = pointer
-        self.inputs = inputs
+        self.inputs = deque(inputs)
         self.output = []
         self.relative_base = relative_base
 
+    def push_input(self, value: int) -> None:
+        self.inputs.append(value)
 
-def parse_modes(value: int) -> (int, List[int]):
-    opcode = int(str(value)[-2:])
-    modes = [int(val) for val in str(value)[:-2]]
-    for i in range(mode_lengths[opcode] - len(modes)):
-        modes.insert(0, 0)
-    return opcode, modes[::-1]
-
-
-def use_mode(array: List[int], pointer: int, relative_base: int, mode: int) -> int:
-    if mode == 0:
-        return array[array[pointer]]
-    elif mode == 1:
-        return array[pointer]
-    elif mode == 2:
-        return array[array[pointer] + relative_base]
-    else:
-        raise ValueError(f"Wrong mode {modes[0]}")
-
-
-def use_mode_insertion(
-    program: Program, pointer_offset: int, value: int, mode: int
-) -> int:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    if mode == 0:
-        program.array[array[pointer + pointer_offset]] = value
-        return program
-    elif mode == 1:
-        raise ValueError("I don't think mode 1 in opcode 3 is valid?")
-    elif mode == 2:
-        program.array[array[pointer + pointer_offset] + relative_base] = value
-        return program
-    else:
-        raise ValueError(f"Wrong mode {modes[0]}")
-
-
-def opcode_1(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    result_sum = first_param + second_param
-    program = use_mode_insertion(program, 3, result_sum, modes[2])
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_2(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    result_sum = first_param * second_param
-    program = use_mode_insertion(program, 3, result_sum, modes[2])
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_3(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    current_input = program.inputs.pop(0)
-    program = use_mode_insertion(program, 1, current_input, modes[0])
-    program.pointer = program.pointer + 2
-    return program
-
-
-def opcode_4(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    param = use_mode(array, pointer + 1, relative_base, modes[0])
-    program.output.append(param)
-    program.pointer = pointer + 2
-    return program
-
-
-def opcode_5(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param != 0:
-        program.pointer = second_param
-    else:
-        program.pointer = pointer + 3
-    return program
-
-
-def opcode_6(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param == 0:
-        program.pointer = second_param
-    else:
-        program.pointer = pointer + 3
-    return program
+    def extend_inputs(self, values: List[int]) -> None:
+        self.inputs.extend(values)
 
-
-def opcode_7(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param < second_param:
-        program = use_mode_insertion(program, 3, 1, modes[2])
-    else:
-        program = use_mode_insertion(program, 3, 0, modes[2])
-    program.pointer = pointer + 4
-    return program
+    def drain_output(self) -> List[int]:
+        # Hands out everything written since the last drain, so consumers only
+        # see new values and old output does not pile up.
+        drained, self.output = self.output, []
+        return drained
 
 
-def opcode_8(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param == second_param:
-        program = use_mode_insertion(program, 3, 1, modes[2])
-    else:
-        program = use_mode_insertion(program, 3, 0, modes[2])
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_9(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    param = use_mode(array, pointer + 1, relative_base, modes[0])
-    program.relative_base = relative_base + param
-    program.pointer = pointer + 2
-    return program
+# Parsed instructions, keyed by the raw value. The same few hundred values are
+# executed over and over, so every one is only parsed (and checked) once.
+decoded_instructions = {}
 
 
-def opcode_99(program: Program, modes: List[int]) -> Program:
-    return program
-
-
-opcode_functions = {
-    1: opcode_1,
-    2: opcode_2,
-    3: opcode_3,
-    4: opcode_4,
-    5: opcode_5,
-    6: opcode_6,
-    7: opcode_7,
-    8: opcode_8,
-    9: opcode_9,
-    99: opcode_99,
-}
-
-
-def do_step(program: Program) -> (Program, bool):
-    opcode, modes = parse_modes(program.array[program.pointer])
+def parse_modes(value: int) -> (int, List[int]):
+    if value in decoded_instructions:
+        return decoded_instructions[value]
+    opcode = int(str(value)[-2:])
     if opcode not in valid_opcodes:
         raise ValueError(f"Invalid opcode {opcode}")
-    new_program = opcode_functions[opcode](program, modes)
-    return new_program, opcode
+    modes = [int(val) for val in str(value)[:-2]]
+    for i in range(mode_lengths[opcode] - len(modes)):
+        modes.insert(0, 0)
+    modes = modes[::-1]
+    if any(mode not in [0, 1, 2] for mode in modes[: mode_lengths[opcode]]):
+        raise ValueError(f"Wrong mode in instruction {value}")
+    if (opcode in writing_opcodes) and (modes[mode_lengths[opcode] - 1] == 1):
+        raise ValueError(f"Mode 1 is not valid for the output of opcode {opcode}")
+    decoded_instructions[value] = opcode, modes
+    return decoded_instructions[value]
+
+
+def grow_memory(array: List[int], pointer: int, relative_base: int) -> None:
+    # Memory only holds the program (plus any extra_memory asked for) and is
+    # grown here once an instruction touches an address past its end. It at
+    # least doubles, so growing costs O(1) per touched address on average.
+    needed = pointer + 4
+    if needed <= len(array):
+        opcode, modes = parse_modes(array[pointer])
+        for offset, mode in enumerate(modes[: mode_lengths[opcode]], 1):
+            if mode == 0:
+                needed = max(needed, array[pointer + offset] + 1)
+            elif mode == 2:
+                needed = max(needed, array[pointer + offset] + relative_base + 1)
+        if needed <= len(array):
+            raise ValueError(f"Negative address in instruction at {pointer}")
+    array.extend([0] * max(needed - len(array), len(array)))
 
 
 def initiate_program(
-    puzzle_input: List[int], input_list: List[int], extra_memory=10000
+    puzzle_input: List[int], input_list: List[int], extra_memory: int = 0
 ) -> Program:
     return Program(
         array=puzzle_input,
@@ -227,14 +92,90 @@ def initiate_program(
     )
 
 
+def continue_program_till_no_input_or_halt(
+    program: Program, last_step: int
+) -> (Program, int):
+    # The whole interpreter lives in this one loop: pointer, relative base and
+    # memory are kept in locals and only written back to the program when it
+    # halts or waits for input. Every parameter is resolved to an address, so
+    # immediate parameters just point at the instruction itself. Instructions
+    # only change state after all their memory accesses succeeded, so after
+    # growing the memory the failed instruction can simply be run again.
+    if last_step == 99:
+        return program, last_step
+    array = program.array
+    inputs = program.inputs
+    output = program.output
+    pointer = program.pointer
+    relative_base = program.relative_base
+    while True:
+        try:
+            opcode, modes = parse_modes(array[pointer])
+            if opcode == 99:
+                last_step = 99
+                break
+            if (opcode == 3) and not inputs:
+                last_step = -1
+                break
+
+            first = pointer + 1
+            if modes[0] == 0:
+                first = array[first]
+            elif modes[0] == 2:
+                first = array[first] + relative_base
+            if opcode == 3:
+                array[first] = inputs[0]
+                inputs.popleft()
+                pointer += 2
+                continue
+            if opcode == 4:
+                output.append(array[first])
+                pointer += 2
+                continue
+            if opcode == 9:
+                relative_base += array[first]
+                pointer += 2
+                continue
+
+            second = pointer + 2
+            if modes[1] == 0:
+                second = array[second]
+            elif modes[1] == 2:
+                second = array[second] + relative_base
+            if opcode == 5:
+                pointer = array[second] if array[first] != 0 else pointer + 3
+                continue
+            if opcode == 6:
+                pointer = array[second] if array[first] == 0 else pointer + 3
+                continue
+
+            third = pointer + 3
+            if modes[2] == 0:
+                third = array[third]
+            elif modes[2] == 2:
+                third = array[third] + relative_base
+            if opcode == 1:
+                array[third] = array[first] + array[second]
+            elif opcode == 2:
+                array[third] = array[first] * array[second]
+            elif opcode == 7:
+                array[third] = 1 if array[first] < array[second] else 0
+            else:
+                array[third] = 1 if array[first] == array[second] else 0
+            pointer += 4
+        except IndexError:
+            grow_memory(array, pointer, relative_base)
+    program.pointer = pointer
+    program.relative_base = relative_base
+    return program, last_step
+
+
 ####################################################################
 
 
 def run_program(puzzle_input: List[int], input_list: List[int]) -> Program:
     program = initiate_program(puzzle_input, input_list)
-    last_step = 0
-    while last_step != 99:
-        program, last_step = do_step(program)
+    program, last_step = continue_program_till_no_input_or_halt(program, 0)
     return program
 
 
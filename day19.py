@@ -1,4 +1,5 @@
-from collections import Counter
+import copy
+from collections import Counter, OrderedDict, deque
 import itertools
 import os
 import sys
@@ -10,6 +11,9 @@ valid_opcodes = [1, 2, 3, 4, 5, 6, 7, 8, 9, 99]
 
 mode_lengths = {1: 3, 2: 3, 3: 1, 4: 1, 5: 2, 6: 2, 7: 3, 8: 3, 9: 1, 99: 0}
 
+# Opcodes whose last parameter is the address that gets written to.
+writing_opcodes = [1, 2, 3, 7, 8]
+
 
 class Program:
     def __init__(
@@ -22,236 +26,446 @@ class Program:
     ):
         self.array = array + [0] * extra_memory
         self.pointer = pointer
-        self.inputs = inputs
+        self.inputs = deque(inputs)
         self.output = []
         self.relative_base = relative_base
+        self.shared_memory = False
+
+    def push_input(self, value: int) -> None:
+        self.inputs.append(value)
+
+    def extend_inputs(self, values: List[int]) -> None:
+        self.inputs.extend(values)
+
+    def drain_output(self) -> List[int]:
+        # Hands out everything written since the last drain, so consumers only
+        # see new values and old output does not pile up.
+        drained, self.output = self.output, []
+        return drained
+
+    def fork(self) -> "Program":
+        # The fork shares its memory with this program until one of them runs:
+        # the running program then takes its own copy (copy on write). Forking
+        # is O(1), and a fork that is never run never copies anything.
+        forked = copy.copy(self)
+        forked.inputs = deque(self.inputs)
+        forked.output = list(self.output)
+        self.shared_memory = True
+        forked.shared_memory = True
+        return forked
+
+    def snapshot(self) -> "Program":
+        # A snapshot is a fork that is only kept to restore from later.
+        return self.fork()
+
+    def restore(self, snapshot: "Program") -> None:
+        restored = snapshot.fork()
+        self.array = restored.array
+        self.pointer = restored.pointer
+        self.inputs = restored.inputs
+        self.output = restored.output
+        self.relative_base = restored.relative_base
+        self.shared_memory = True
+
+
+# Parsed instructions, keyed by the raw value. The same few hundred values are
+# executed over and over, so every one is only parsed (and checked) once.
+decoded_instructions = {}
 
 
 def parse_modes(value: int) -> (int, List[int]):
+    if value in decoded_instructions:
+        return decoded_instructions[value]
     opcode = int(str(value)[-2:])
+    if opcode not in valid_opcodes:
+        raise ValueError(f"Invalid opcode {opcode}")
     modes = [int(val) for val in str(value)[:-2]]
     for i in range(mode_lengths[opcode] - len(modes)):
         modes.insert(0, 0)
-    return opcode, modes[::-1]
-
-
-def use_mode(array: List[int], pointer: int, relative_base: int, mode: int) -> int:
-    if mode == 0:
-        return array[array[pointer]]
-    elif mode == 1:
-        return array[pointer]
-    elif mode == 2:
-        return array[array[pointer] + relative_base]
-    else:
-        raise ValueError(f"Wrong mode {modes[0]}")
-
-
-def use_mode_insertion(
-    program: Program, pointer_offset: int, value: int, mode: int
-) -> int:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    if mode == 0:
-        program.array[array[pointer + pointer_offset]] = value
-        return program
-    elif mode == 1:
-        raise ValueError("I don't think mode 1 in opcode 3 is valid?")
-    elif mode == 2:
-        program.array[array[pointer + pointer_offset] + relative_base] = value
-        return program
-    else:
-        raise ValueError(f"Wrong mode {modes[0]}")
-
-
-def opcode_1(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    result_sum = first_param + second_param
-    program = use_mode_insertion(program, 3, result_sum, modes[2])
-    program.pointer = pointer + 4
-    return program
+    modes = modes[::-1]
+    if any(mode not in [0, 1, 2] for mode in modes[: mode_lengths[opcode]]):
+        raise ValueError(f"Wrong mode in instruction {value}")
+    if (opcode in writing_opcodes) and (modes[mode_lengths[opcode] - 1] == 1):
+        raise ValueError(f"Mode 1 is not valid for the output of opcode {opcode}")
+    decoded_instructions[value] = opcode, modes
+    return decoded_instructions[value]
+
+
+def grow_memory(array: List[int], pointer: int, relative_base: int) -> None:
+    # Memory only holds the program (plus any extra_memory asked for) and is
+    # grown here once an instruction touches an address past its end. It at
+    # least doubles, so growing costs O(1) per touched address on average.
+    needed = pointer + 4
+    if needed <= len(array):
+        opcode, modes = parse_modes(array[pointer])
+        for offset, mode in enumerate(modes[: mode_lengths[opcode]], 1):
+            if mode == 0:
+                needed = max(needed, array[pointer + offset] + 1)
+            elif mode == 2:
+                needed = max(needed, array[pointer + offset] + relative_base + 1)
+        if needed <= len(array):
+            raise ValueError(f"Negative address in instruction at {pointer}")
+    array.extend([0] * max(needed - len(array), len(array)))
 
 
-def opcode_2(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
+def initiate_program(
+    puzzle_input: List[int], input_list: List[int], extra_memory: int = 0
+) -> Program:
+    return Program(
+        array=puzzle_input,
+        pointer=0,
+        inputs=input_list,
+        relative_base=0,
+        extra_memory=extra_memory,
     )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    result_sum = first_param * second_param
-    program = use_mode_insertion(program, 3, result_sum, modes[2])
-    program.pointer = pointer + 4
-    return program
 
 
-def opcode_3(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    current_input = program.inputs.pop(0)
-    program = use_mode_insertion(program, 1, current_input, modes[0])
-    program.pointer = program.pointer + 2
-    return program
-
+def continue_program_till_no_input_or_halt(
+    program: Program, last_step: int
+) -> (Program, int):
+    # The whole interpreter lives in this one loop: pointer, relative base and
+    # memory are kept in locals and only written back to the program when it
+    # halts or waits for input. Every parameter is resolved to an address, so
+    # immediate parameters just point at the instruction itself. Instructions
+    # only change state after all their memory accesses succeeded, so after
+    # growing the memory the failed instruction can simply be run again.
+    if last_step == 99:
+        return program, last_step
+    if program.shared_memory:
+        program.array = list(program.array)
+        program.shared_memory = False
+    array = program.array
+    inputs = program.inputs
+    output = program.output
+    pointer = program.pointer
+    relative_base = program.relative_base
+    while True:
+        try:
+            opcode, modes = parse_modes(array[pointer])
+            if opcode == 99:
+                last_step = 99
+                break
+            if (opcode == 3) and not inputs:
+                last_step = -1
+                break
+
+            first = pointer + 1
+            if modes[0] == 0:
+                first = array[first]
+            elif modes[0] == 2:
+                first = array[first] + relative_base
+            if opcode == 3:
+                array[first] = inputs[0]
+                inputs.popleft()
+                pointer += 2
+                continue
+            if opcode == 4:
+                output.append(array[first])
+                pointer += 2
+                continue
+            if opcode == 9:
+                relative_base += array[first]
+                pointer += 2
+                continue
+
+            second = pointer + 2
+            if modes[1] == 0:
+                second = array[second]
+            elif modes[1] == 2:
+                second = array[second] + relative_base
+            if opcode == 5:
+                pointer = array[second] if array[first] != 0 else pointer + 3
+                continue
+            if opcode == 6:
+                pointer = array[second] if array[first] == 0 else pointer + 3
+                continue
+
+            third = pointer + 3
+            if modes[2] == 0:
+                third = array[third]
+            elif modes[2] == 2:
+                third = array[third] + relative_base
+            if opcode == 1:
+                array[third] = array[first] + array[second]
+            elif opcode == 2:
+                array[third] = array[first] * array[second]
+            elif opcode == 7:
+                array[third] = 1 if array[first] < array[second] else 0
+            else:
+                array[third] = 1 if array[first] == array[second] else 0
+            pointer += 4
+        except IndexError:
+            grow_memory(array, pointer, relative_base)
+    program.pointer = pointer
+    program.relative_base = relative_base
+    return program, last_step
 
-def opcode_4(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    param = use_mode(array, pointer + 1, relative_base, modes[0])
-    program.output.append(param)
-    program.pointer = pointer + 2
-    return program
 
+####################################################################
 
-def opcode_5(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param != 0:
-        program.pointer = second_param
-    else:
-        program.pointer = pointer + 3
-    return program
 
+#################### LOCKSTEP BATCHES ############################
+# Runs many copies (lanes) of a program side by side. Memory is stored by
+# address: memory[address] holds the value of that address for every lane of
+# a batch, so one instruction is decoded once and carried out for all lanes
+# in a single list comprehension. When lanes stop agreeing on where to go
+# next (a different instruction, jump or relative base), the batch is split
+# into one batch per destination. Lanes can not wait for input.
 
-def opcode_6(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param == 0:
-        program.pointer = second_param
-    else:
-        program.pointer = pointer + 3
-    return program
+# The lanes do not go through continue_program_till_no_input_or_halt, so
+# solve_1 only uses them as long as nobody swapped in another runner for it
+# (like intcode.py --day does to profile or trace a day).
+lockstep_interpreter = continue_program_till_no_input_or_halt
 
 
-def opcode_7(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param < second_param:
-        program = use_mode_insertion(program, 3, 1, modes[2])
-    else:
-        program = use_mode_insertion(program, 3, 0, modes[2])
-    program.pointer = pointer + 4
-    return program
+class Lane(NamedTuple):
+    memory: List[int]
+    output: List[int]
 
 
-def opcode_8(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param == second_param:
-        program = use_mode_insertion(program, 3, 1, modes[2])
+class Batch:
+    def __init__(
+        self,
+        lanes: List[int],
+        memory: List[List[int]],
+        pointer: int,
+        relative_base: int,
+        inputs_used: int,
+    ):
+        self.lanes = lanes
+        self.memory = memory
+        self.pointer = pointer
+        self.relative_base = relative_base
+        self.inputs_used = inputs_used
+
+    def split(self, keys: List[int]) -> Dict[int, "Batch"]:
+        # One batch for every distinct key, holding the lanes with that key.
+        groups = {}
+        for index, key in enumerate(keys):
+            groups.setdefault(key, []).append(index)
+        return {
+            key: Batch(
+                [self.lanes[index] for index in indices],
+                [[column[index] for index in indices] for column in self.memory],
+                self.pointer,
+                self.relative_base,
+                self.inputs_used,
+            )
+            for key, indices in groups.items()
+        }
+
+
+def lane_addresses(batch: Batch, address: int, mode: int) -> (int, List[int]):
+    # Resolves a parameter to one address shared by all lanes, or to a list
+    # with one address per lane (the other one is None).
+    if mode == 1:
+        return address, None
+    addresses = batch.memory[address]
+    if mode == 2:
+        addresses = [value + batch.relative_base for value in addresses]
+    if addresses.count(addresses[0]) == len(addresses):
+        if addresses[0] < 0:
+            raise ValueError(f"Negative address in instruction at {batch.pointer}")
+        grow_columns(batch, addresses[0])
+        return addresses[0], None
+    if min(addresses) < 0:
+        raise ValueError(f"Negative address in instruction at {batch.pointer}")
+    grow_columns(batch, max(addresses))
+    return None, addresses
+
+
+def grow_columns(batch: Batch, address: int) -> None:
+    lanes = len(batch.lanes)
+    while address >= len(batch.memory):
+        batch.memory.append([0] * lanes)
+
+
+def read_lanes(batch: Batch, address: int, addresses: List[int]) -> List[int]:
+    if addresses is None:
+        return batch.memory[address]
+    memory = batch.memory
+    return [memory[address][lane] for lane, address in enumerate(addresses)]
+
+
+def write_lanes(
+    batch: Batch, address: int, addresses: List[int], values: List[int]
+) -> None:
+    if addresses is None:
+        batch.memory[address] = values
     else:
-        program = use_mode_insertion(program, 3, 0, modes[2])
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_9(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    param = use_mode(array, pointer + 1, relative_base, modes[0])
-    program.relative_base = relative_base + param
-    program.pointer = pointer + 2
+        memory = batch.memory
+        for lane, address in enumerate(addresses):
+            memory[address][lane] = values[lane]
+
+
+def run_lockstep(
+    memory: List[List[int]],
+    lane_inputs: List[List[int]],
+    pointer: int = 0,
+    relative_base: int = 0,
+) -> List[Lane]:
+    # Runs every lane with its inputs until it halts, starting all of them at
+    # the same pointer and relative base. memory[address][lane] is the start
+    # memory of the lanes, and is used up by the run.
+    lanes = list(range(len(lane_inputs)))
+    batches = [Batch(lanes, memory, pointer, relative_base, 0)]
+    results = [None] * len(lanes)
+    outputs = [[] for _ in lanes]
+    while batches:
+        batch = batches.pop()
+        while True:
+            grow_columns(batch, batch.pointer + 3)
+            instructions = batch.memory[batch.pointer]
+            if instructions.count(instructions[0]) != len(instructions):
+                batches.extend(batch.split(instructions).values())
+                break
+            opcode, modes = parse_modes(instructions[0])
+            pointer = batch.pointer
+            if opcode == 99:
+                for lane, memory in zip(batch.lanes, zip(*batch.memory)):
+                    results[lane] = Lane(list(memory), outputs[lane])
+                break
+
+            first, firsts = lane_addresses(batch, pointer + 1, modes[0])
+            if opcode == 3:
+                values = []
+                for lane in batch.lanes:
+                    if batch.inputs_used == len(lane_inputs[lane]):
+                        raise ValueError(f"Lane {lane} ran out of input")
+                    values.append(lane_inputs[lane][batch.inputs_used])
+                batch.inputs_used += 1
+                write_lanes(batch, first, firsts, values)
+                batch.pointer += 2
+                continue
+            x = read_lanes(batch, first, firsts)
+            if opcode == 4:
+                for lane, value in zip(batch.lanes, x):
+                    outputs[lane].append(value)
+                batch.pointer += 2
+                continue
+            if opcode == 9:
+                batch.pointer += 2
+                if x.count(x[0]) != len(x):
+                    bases = [batch.relative_base + value for value in x]
+                    for base, part in batch.split(bases).items():
+                        part.relative_base = base
+                        batches.append(part)
+                    break
+                batch.relative_base += x[0]
+                continue
+
+            second, seconds = lane_addresses(batch, pointer + 2, modes[1])
+            y = read_lanes(batch, second, seconds)
+            if opcode in [5, 6]:
+                jump = opcode == 5
+                targets = [
+                    target if (value != 0) == jump else pointer + 3
+                    for value, target in zip(x, y)
+                ]
+                if targets.count(targets[0]) != len(targets):
+                    for target, part in batch.split(targets).items():
+                        part.pointer = target
+                        batches.append(part)
+                    break
+                batch.pointer = targets[0]
+                continue
+
+            third, thirds = lane_addresses(batch, pointer + 3, modes[2])
+            if opcode == 1:
+                values = [a + b for a, b in zip(x, y)]
+            elif opcode == 2:
+                values = [a * b for a, b in zip(x, y)]
+            elif opcode == 7:
+                values = [1 if a < b else 0 for a, b in zip(x, y)]
+            else:
+                values = [1 if a == b else 0 for a, b in zip(x, y)]
+            write_lanes(batch, third, thirds, values)
+            batch.pointer += 4
+    return results
+
+
+def boot_drone(puzzle_input: List[int]) -> Program:
+    # Runs the program up to its first input once. Every probe is then a fork
+    # of this booted program instead of a new one started from scratch.
+    program = initiate_program(puzzle_input, [])
+    program, last_step = continue_program_till_no_input_or_halt(program, 0)
     return program
 
 
-def opcode_99(program: Program, modes: List[int]) -> Program:
-    return program
+def probe(drone: Program, x: int, y: int) -> List[int]:
+    program = drone.fork()
+    program.extend_inputs([x, y])
+    program, last_step = continue_program_till_no_input_or_halt(program, 0)
+    return program.output
 
 
-opcode_functions = {
-    1: opcode_1,
-    2: opcode_2,
-    3: opcode_3,
-    4: opcode_4,
-    5: opcode_5,
-    6: opcode_6,
-    7: opcode_7,
-    8: opcode_8,
-    9: opcode_9,
-    99: opcode_99,
-}
+def is_input_pure(drone: Program, samples: List[Tuple[int, int]]) -> bool:
+    # Every probe is a fork of the same booted drone and the computer is
+    # deterministic, so a probe that halts right after using its two inputs
+    # only depends on them. That is what makes caching probes safe, and all
+    # that is checked here.
+    for x, y in samples:
+        program = drone.fork()
+        program.extend_inputs([x, y])
+        program, last_step = continue_program_till_no_input_or_halt(program, 0)
+        if (last_step != 99) or program.inputs:
+            return False
+    return True
 
 
-def do_step(program: Program) -> (Program, bool):
-    opcode, modes = parse_modes(program.array[program.pointer])
-    if opcode not in valid_opcodes:
-        raise ValueError(f"Invalid opcode {opcode}")
-    if (opcode == 3) and (program.inputs == []):
-        return program, -1
-    new_program = opcode_functions[opcode](program, modes)
-    return new_program, opcode
+class ProbeCache:
+    # Results of probes, keyed by (program hash, inputs). The least recently
+    # used result is evicted once max_size results are kept.
+    def __init__(self, max_size: int):
+        self.results = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
 
+    def probe(self, program_hash: int, drone: Program, x: int, y: int) -> List[int]:
+        key = program_hash, (x, y)
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            return self.results[key]
+        self.misses += 1
+        output = probe(drone, x, y)
+        self.store(program_hash, x, y, output)
+        return output
 
-def initiate_program(
-    puzzle_input: List[int], input_list: List[int], extra_memory: int = 10000
-) -> Program:
-    return Program(
-        array=puzzle_input,
-        pointer=0,
-        inputs=input_list,
-        relative_base=0,
-        extra_memory=extra_memory,
-    )
+    def store(self, program_hash: int, x: int, y: int, output: List[int]) -> None:
+        self.results[program_hash, (x, y)] = output
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
 
 
-def continue_program_till_no_input_or_halt(
-    program: Program, last_step: int
-) -> (Program, int):
-    if last_step != 99:
-        last_step = 0
-    while (last_step != -1) and (last_step != 99):
-        program, last_step = do_step(program)
-    return program, last_step
+probe_cache = ProbeCache(max_size=1 << 16)
 
 
-####################################################################
+def boot_pure_drone(puzzle_input: List[int]) -> (int, Program):
+    drone = boot_drone(puzzle_input)
+    if not is_input_pure(drone, [(0, 0), (10, 10), (3, 7)]):
+        raise ValueError("Probes of this drone program can not be cached")
+    return hash(tuple(puzzle_input)), drone
 
 
 def solve_1(puzzle_input: List[int]):
+    # All 2500 probes run at once, see run_lockstep.
+    program_hash, drone = boot_pure_drone(puzzle_input)
+    coordinates = [(i, j) for i in range(50) for j in range(50)]
+    if continue_program_till_no_input_or_halt is not lockstep_interpreter:
+        outputs = [
+            probe_cache.probe(program_hash, drone, i, j)[0] for i, j in coordinates
+        ]
+        return Counter(outputs)[1]
+    memory = [[value] * len(coordinates) for value in drone.array]
+    lanes = run_lockstep(
+        memory, [[i, j] for i, j in coordinates], drone.pointer, drone.relative_base
+    )
     outputs = []
-    for i in range(50):
-        for j in range(50):
-            program = initiate_program(puzzle_input, [i, j])
-            program, last_step = continue_program_till_no_input_or_halt(program, 0)
-            outputs.append(program.output[0])
+    for (i, j), lane in zip(coordinates, lanes):
+        probe_cache.store(program_hash, i, j, lane.output)
+        outputs.append(lane.output[0])
     return Counter(outputs)[1]
 
 
@@ -262,6 +476,7 @@ class Output(NamedTuple):
 
 
 def solve_2(puzzle_input: List[int]):
+    program_hash, drone = boot_pure_drone(puzzle_input)
     last_left_end = 5
     last_right_end = 5
     endpoints = []
@@ -275,9 +490,7 @@ def solve_2(puzzle_input: List[int]):
             print(f"Currently at row {row} of {max_row}.")
         line = []
         for col in range((last_left_end - 2), (last_left_end + 6)):
-            program = initiate_program(puzzle_input, [col, row])
-            program, last_step = continue_program_till_no_input_or_halt(program, 0)
-            line = line + program.output
+            line = line + probe_cache.probe(program_hash, drone, col, row)
         last_left_end = (
             min([i for i in range(len(line)) if line[i] == 1]) + last_left_end - 1
         )
@@ -285,9 +498,7 @@ def solve_2(puzzle_input: List[int]):
 
         line = []
         for col in range((last_right_end - 2), (last_right_end + 6)):
-            program = initiate_program(puzzle_input, [col, row])
-            program, last_step = continue_program_till_no_input_or_halt(program, 0)
-            line = line + program.output
+            line = line + probe_cache.probe(program_hash, drone, col, row)
         last_right_end = (
             max([i for i in range(len(line)) if line[i] == 1]) + last_right_end - 1
         )
@@ -308,3 +519,4 @@ if __name__ == "__main__":
     puzzle_input = [int(x) for x in puzzle_input.split(",")]
     print("Result 1:", solve_1(puzzle_input))
     solve_2(puzzle_input)
+    print(f"Probe cache: {probe_cache.hits} hits, {probe_cache.misses} misses")
@@ -1,6 +1,8 @@
+import asyncio
 import itertools
 import os
 import sys
+from collections import deque
 from typing import Any, Dict, List, NamedTuple, NewType, Set, Tuple
 
 #################### INTCODE COMPUTER ############################
@@ -8,6 +10,9 @@ valid_opcodes = [1, 2, 3, 4, 5, 6, 7, 8, 9, 99]
 
 mode_lengths = {1: 3, 2: 3, 3: 1, 4: 1, 5: 2, 6: 2, 7: 3, 8: 3, 9: 1, 99: 0}
 
+# Opcodes whose last parameter is the address that gets written to.
+writing_opcodes = [1, 2, 3, 7, 8]
+
 
 class Program:
     def __init__(
@@ -20,206 +25,65 @@ class Program:
     ):
         self.array = array + [0] * extra_memory
         self.pointer = pointer
-        self.inputs = inputs
+        self.inputs = deque(inputs)
         self.output = []
         self.relative_base = relative_base
 
+    def push_input(self, value: int) -> None:
+        self.inputs.append(value)
 
-def parse_modes(value: int) -> (int, List[int]):
-    opcode = int(str(value)[-2:])
-    modes = [int(val) for val in str(value)[:-2]]
-    for i in range(mode_lengths[opcode] - len(modes)):
-        modes.insert(0, 0)
-    return opcode, modes[::-1]
-
-
-def use_mode(array: List[int], pointer: int, relative_base: int, mode: int) -> int:
-    if mode == 0:
-        return array[array[pointer]]
-    elif mode == 1:
-        return array[pointer]
-    elif mode == 2:
-        return array[array[pointer] + relative_base]
-    else:
-        raise ValueError(f"Wrong mode {modes[0]}")
-
-
-def use_mode_insertion(
-    program: Program, pointer_offset: int, value: int, mode: int
-) -> int:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    if mode == 0:
-        program.array[array[pointer + pointer_offset]] = value
-        return program
-    elif mode == 1:
-        raise ValueError("I don't think mode 1 in opcode 3 is valid?")
-    elif mode == 2:
-        program.array[array[pointer + pointer_offset] + relative_base] = value
-        return program
-    else:
-        raise ValueError(f"Wrong mode {modes[0]}")
-
-
-def opcode_1(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    result_sum = first_param + second_param
-    program = use_mode_insertion(program, 3, result_sum, modes[2])
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_2(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    result_sum = first_param * second_param
-    program = use_mode_insertion(program, 3, result_sum, modes[2])
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_3(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    current_input = program.inputs.pop(0)
-    program = use_mode_insertion(program, 1, current_input, modes[0])
-    program.pointer = program.pointer + 2
-    return program
-
-
-def opcode_4(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    param = use_mode(array, pointer + 1, relative_base, modes[0])
-    program.output.append(param)
-    program.pointer = pointer + 2
-    return program
+    def extend_inputs(self, values: List[int]) -> None:
+        self.inputs.extend(values)
 
+    def drain_output(self) -> List[int]:
+        # Hands out everything written since the last drain, so consumers only
+        # see new values and old output does not pile up.
+        drained, self.output = self.output, []
+        return drained
 
-def opcode_5(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param != 0:
-        program.pointer = second_param
-    else:
-        program.pointer = pointer + 3
-    return program
-
-
-def opcode_6(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param == 0:
-        program.pointer = second_param
-    else:
-        program.pointer = pointer + 3
-    return program
-
-
-def opcode_7(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param < second_param:
-        program = use_mode_insertion(program, 3, 1, modes[2])
-    else:
-        program = use_mode_insertion(program, 3, 0, modes[2])
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_8(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    first_param = use_mode(array, pointer + 1, relative_base, modes[0])
-    second_param = use_mode(array, pointer + 2, relative_base, modes[1])
-    if first_param == second_param:
-        program = use_mode_insertion(program, 3, 1, modes[2])
-    else:
-        program = use_mode_insertion(program, 3, 0, modes[2])
-    program.pointer = pointer + 4
-    return program
-
-
-def opcode_9(program: Program, modes: List[int]) -> Program:
-    pointer, array, relative_base = (
-        program.pointer,
-        program.array,
-        program.relative_base,
-    )
-    param = use_mode(array, pointer + 1, relative_base, modes[0])
-    program.relative_base = relative_base + param
-    program.pointer = pointer + 2
-    return program
 
+# Parsed instructions, keyed by the raw value. The same few hundred values are
+# executed over and over, so every one is only parsed (and checked) once.
+decoded_instructions = {}
 
-def opcode_99(program: Program, modes: List[int]) -> Program:
-    return program
 
-
-opcode_functions = {
-    1: opcode_1,
-    2: opcode_2,
-    3: opcode_3,
-    4: opcode_4,
-    5: opcode_5,
-    6: opcode_6,
-    7: opcode_7,
-    8: opcode_8,
-    9: opcode_9,
-    99: opcode_99,
-}
-
-
-def do_step(program: Program) -> (Program, bool):
-    opcode, modes = parse_modes(program.array[program.pointer])
+def parse_modes(value: int) -> (int, List[int]):
+    if value in decoded_instructions:
+        return decoded_instructions[value]
+    opcode = int(str(value)[-2:])
     if opcode not in valid_opcodes:
         raise ValueError(f"Invalid opcode {opcode}")
-    if (opcode == 3) and (program.inputs == []):
-        return program, -1
-    new_program = opcode_functions[opcode](program, modes)
-    return new_program, opcode
+    modes = [int(val) for val in str(value)[:-2]]
+    for i in range(mode_lengths[opcode] - len(modes)):
+        modes.insert(0, 0)
+    modes = modes[::-1]
+    if any(mode not in [0, 1, 2] for mode in modes[: mode_lengths[opcode]]):
+        raise ValueError(f"Wrong mode in instruction {value}")
+    if (opcode in writing_opcodes) and (modes[mode_lengths[opcode] - 1] == 1):
+        raise ValueError(f"Mode 1 is not valid for the output of opcode {opcode}")
+    decoded_instructions[value] = opcode, modes
+    return decoded_instructions[value]
+
+
+def grow_memory(array: List[int], pointer: int, relative_base: int) -> None:
+    # Memory only holds the program (plus any extra_memory asked for) and is
+    # grown here once an instruction touches an address past its end. It at
+    # least doubles, so growing costs O(1) per touched address on average.
+    needed = pointer + 4
+    if needed <= len(array):
+        opcode, modes = parse_modes(array[pointer])
+        for offset, mode in enumerate(modes[: mode_lengths[opcode]], 1):
+            if mode == 0:
+                needed = max(needed, array[pointer + offset] + 1)
+            elif mode == 2:
+                needed = max(needed, array[pointer + offset] + relative_base + 1)
+        if needed <= len(array):
+            raise ValueError(f"Negative address in instruction at {pointer}")
+    array.extend([0] * max(needed - len(array), len(array)))
 
 
 def initiate_program(
-    puzzle_input: List[int], input_list: List[int], extra_memory: int = 10000
+    puzzle_input: List[int], input_list: List[int], extra_memory: int = 0
 ) -> Program:
     return Program(
         array=puzzle_input,
@@ -233,73 +97,192 @@ def initiate_program(
 def continue_program_till_no_input_or_halt(
     program: Program, last_step: int
 ) -> (Program, int):
-    if last_step != 99:
-        last_step = 0
-    while (last_step != -1) and (last_step != 99):
-        program, last_step = do_step(program)
+    # The whole interpreter lives in this one loop: pointer, relative base and
+    # memory are kept in locals and only written back to the program when it
+    # halts or waits for input. Every parameter is resolved to an address, so
+    # immediate parameters just point at the instruction itself. Instructions
+    # only change state after all their memory accesses succeeded, so after
+    # growing the memory the failed instruction can simply be run again.
+    if last_step == 99:
+        return program, last_step
+    array = program.array
+    inputs = program.inputs
+    output = program.output
+    pointer = program.pointer
+    relative_base = program.relative_base
+    while True:
+        try:
+            opcode, modes = parse_modes(array[pointer])
+            if opcode == 99:
+                last_step = 99
+                break
+            if (opcode == 3) and not inputs:
+                last_step = -1
+                break
+
+            first = pointer + 1
+            if modes[0] == 0:
+                first = array[first]
+            elif modes[0] == 2:
+                first = array[first] + relative_base
+            if opcode == 3:
+                array[first] = inputs[0]
+                inputs.popleft()
+                pointer += 2
+                continue
+            if opcode == 4:
+                output.append(array[first])
+                pointer += 2
+                continue
+            if opcode == 9:
+                relative_base += array[first]
+                pointer += 2
+                continue
+
+            second = pointer + 2
+            if modes[1] == 0:
+                second = array[second]
+            elif modes[1] == 2:
+                second = array[second] + relative_base
+            if opcode == 5:
+                pointer = array[second] if array[first] != 0 else pointer + 3
+                continue
+            if opcode == 6:
+                pointer = array[second] if array[first] == 0 else pointer + 3
+                continue
+
+            third = pointer + 3
+            if modes[2] == 0:
+                third = array[third]
+            elif modes[2] == 2:
+                third = array[third] + relative_base
+            if opcode == 1:
+                array[third] = array[first] + array[second]
+            elif opcode == 2:
+                array[third] = array[first] * array[second]
+            elif opcode == 7:
+                array[third] = 1 if array[first] < array[second] else 0
+            else:
+                array[third] = 1 if array[first] == array[second] else 0
+            pointer += 4
+        except IndexError:
+            grow_memory(array, pointer, relative_base)
+    program.pointer = pointer
+    program.relative_base = relative_base
     return program, last_step
 
 
+def poll_input(
+    program: Program, last_step: int, idle_input: int = -1
+) -> (Program, int, bool):
+    # Runs a program that waits for input with idle_input (the "no input" of
+    # polling programs) till it waits again. If it wrote nothing and came back
+    # to the same instruction with the same memory and relative base, it would
+    # do just that on every further idle_input, so it can be parked until real
+    # input arrives. That is the third value returned.
+    before = program.pointer, program.relative_base, program.array[:]
+    written = len(program.output)
+    program.push_input(idle_input)
+    program, last_step = continue_program_till_no_input_or_halt(program, last_step)
+    parked = (len(program.output) == written) and (
+        before == (program.pointer, program.relative_base, program.array)
+    )
+    return program, last_step, parked
+
+
 ####################################################################
 
 
+class Network:
+    # Every NIC is an asyncio task. A NIC whose queue is empty and that sent
+    # nothing when polled with -1 is idle, and one that poll_input parks (it
+    # would just keep reading -1) waits on its queue instead of being polled
+    # again, so only NICs with work get to run. The network is idle when all
+    # NICs are idle and all queues are empty.
+    def __init__(self, puzzle_input: List[int], size: int = 50):
+        self.size = size
+        self.queues = [asyncio.Queue() for _ in range(size)]
+        self.programs = [initiate_program(puzzle_input, [i]) for i in range(size)]
+        self.idle = set()
+        self.all_idle = asyncio.Event()
+        self.nat_packet = None
+        self.first_nat_packet = asyncio.get_running_loop().create_future()
+
+    def send(self, output: List[int]) -> None:
+        for i in range(0, len(output) - 2, 3):
+            address, x, y = output[i : i + 3]
+            if address == 255:
+                self.nat_packet = (x, y)
+                if not self.first_nat_packet.done():
+                    self.first_nat_packet.set_result(self.nat_packet)
+            else:
+                self.queues[address].put_nowait((x, y))
+
+    def is_idle(self) -> bool:
+        return (len(self.idle) == self.size) and all(
+            queue.empty() for queue in self.queues
+        )
+
+    async def run_nic(self, address: int) -> None:
+        program = self.programs[address]
+        queue = self.queues[address]
+        while True:
+            if not queue.empty():
+                self.idle.discard(address)
+                program.extend_inputs(queue.get_nowait())
+                program, _ = continue_program_till_no_input_or_halt(program, 0)
+            else:
+                program, _, parked = poll_input(program, 0)
+                if not program.output:
+                    self.idle.add(address)
+                    if self.is_idle():
+                        self.all_idle.set()
+                    if parked:
+                        program.extend_inputs(await queue.get())
+                        self.idle.discard(address)
+                        program, _ = continue_program_till_no_input_or_halt(program, 0)
+            output = program.drain_output()
+            if output:
+                self.idle.discard(address)
+                self.send(output)
+            # Let the other NICs have a go.
+            await asyncio.sleep(0)
+
+    async def run_nat(self) -> int:
+        # Wakes up the network with the last packet sent to the NAT, until it
+        # sends the same y twice in a row.
+        last_y = None
+        while True:
+            await self.all_idle.wait()
+            self.all_idle.clear()
+            if not self.is_idle() or (self.nat_packet is None):
+                continue
+            x, y = self.nat_packet
+            if y == last_y:
+                return y
+            last_y = y
+            self.queues[0].put_nowait((x, y))
+
+
+async def run_network(puzzle_input: List[int], part: int) -> int:
+    network = Network(puzzle_input)
+    nics = [asyncio.create_task(network.run_nic(i)) for i in range(network.size)]
+    try:
+        if part == 1:
+            x, y = await network.first_nat_packet
+            return y
+        return await network.run_nat()
+    finally:
+        for nic in nics:
+            nic.cancel()
+
+
 def solve_1(puzzle_input: List[int]):
-    robots = [initiate_program(puzzle_input, [i]) for i in range(50)]
+    return asyncio.run(run_network(puzzle_input, 1))
 
-    current_robot = 0
-    while True:
-        print(current_robot)
-        if robots[current_robot].inputs == []:
-            robots[current_robot].inputs = [-1]
-        robots[current_robot], _ = continue_program_till_no_input_or_halt(robots[current_robot], 0)
-        
-        output = robots[current_robot].output
-        packages = {0: [], 1: [], 2: []}
-        [packages[i % 3].append(val) for i, val in enumerate(output)]
-        if output != []:
-            for i in range(len(output) // 3):
-                if packages[0][i] == 255:
-                    return packages[2][i]
-                robots[packages[0][i]].inputs.extend([packages[1][i], packages[2][i]])
-            
-        robots[current_robot].output = []
-        current_robot = (current_robot + 1) % 50
-    return robots[current_robot.output[-1]],
 
 def solve_2(puzzle_input: List[int]):
-    robots = [initiate_program(puzzle_input, [i]) for i in range(50)]
-
-    current_robot = 0
-    idle = set()
-    nat = (0, 0)
-    while True:
-        if robots[current_robot].inputs == []:
-            idle.add(current_robot)
-            robots[current_robot].inputs = [-1]
-        elif current_robot in idle:
-            idle.remove(current_robot)
-        robots[current_robot], _ = continue_program_till_no_input_or_halt(robots[current_robot], 0)
-        
-        output = robots[current_robot].output
-        packages = {0: [], 1: [], 2: []}
-        [packages[i % 3].append(val) for i, val in enumerate(output)]
-        if output != []:
-            for i in range(len(output) // 3):
-                if packages[0][i] == 255:
-                    last_nat = (nat[0], nat[1])
-                    nat = (packages[1][i], packages[2][i])
-                else:
-                    robots[packages[0][i]].inputs.extend([packages[1][i], packages[2][i]])
-            
-        robots[current_robot].output = []
-        current_robot = (current_robot + 1) % 50
-
-        if all([i in idle for i in range(50)]):
-            if last_nat[1] == nat[1]:
-                return nat[1]
-            robots[0].inputs = [nat[0], nat[1]]
-            current_robot = 0
-    return robots[current_robot.output[-1]]
+    return asyncio.run(run_network(puzzle_input, 2))
 
 
 if __name__ == "__main__":
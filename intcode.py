@@ -0,0 +1,2721 @@
+import array
+import concurrent.futures
+import copy
+import importlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import deque
+from typing import Callable, Dict, Generator, Iterator, List, NamedTuple, Tuple
+
+#################### INTCODE COMPUTER ############################
+valid_opcodes = [1, 2, 3, 4, 5, 6, 7, 8, 9, 99]
+
+mode_lengths = {1: 3, 2: 3, 3: 1, 4: 1, 5: 2, 6: 2, 7: 3, 8: 3, 9: 1, 99: 0}
+
+# Opcodes whose last parameter is the address that gets written to.
+writing_opcodes = [1, 2, 3, 7, 8]
+
+
+class Program:
+    def __init__(
+        self,
+        array: List[int],
+        pointer: int,
+        inputs: List[int],
+        relative_base: int,
+        extra_memory: int,
+    ):
+        if isinstance(array, list):
+            self.array = array + [0] * extra_memory
+        else:
+            # Compact memory, see compact_memory.
+            self.array = array[:]
+            self.array.frombytes(bytes(8 * extra_memory))
+        self.pointer = pointer
+        self.inputs = deque(inputs)
+        self.output = []
+        self.relative_base = relative_base
+        self.shared_memory = False
+        self.block_cache = None
+        self.fusion_table = None
+
+    def push_input(self, value: int) -> None:
+        self.inputs.append(value)
+
+    def extend_inputs(self, values: List[int]) -> None:
+        self.inputs.extend(values)
+
+    def drain_output(self) -> List[int]:
+        # Hands out everything written since the last drain, so consumers only
+        # see new values and old output does not pile up.
+        drained, self.output = self.output, []
+        return drained
+
+    def fork(self) -> "Program":
+        # The fork shares its memory with this program until one of them runs:
+        # the running program then takes its own copy (copy on write). Forking
+        # is O(1), and a fork that is never run never copies anything.
+        forked = copy.copy(self)
+        forked.inputs = deque(self.inputs)
+        forked.output = list(self.output)
+        forked.block_cache = None
+        forked.fusion_table = None
+        self.shared_memory = True
+        forked.shared_memory = True
+        return forked
+
+    def snapshot(self) -> "Program":
+        # A snapshot is a fork that is only kept to restore from later.
+        return self.fork()
+
+    def restore(self, snapshot: "Program") -> None:
+        restored = snapshot.fork()
+        self.array = restored.array
+        self.pointer = restored.pointer
+        self.inputs = restored.inputs
+        self.output = restored.output
+        self.relative_base = restored.relative_base
+        self.shared_memory = True
+        self.block_cache = None
+        self.fusion_table = None
+
+    def checkpoint(self, path: str) -> None:
+        # Saves memory, pointer, relative base and queued inputs and outputs to
+        # a file, see PROGRAM IMAGES. The file is replaced in one go, so an
+        # interrupted checkpoint leaves the previous one intact.
+        parts = [
+            image_from_program(part)
+            for part in [self.array, list(self.inputs), self.output]
+        ]
+        header = checkpoint_header.pack(
+            checkpoint_magic,
+            self.pointer,
+            self.relative_base,
+            *[len(part) for part in parts],
+        )
+        with open(path + ".tmp", "wb") as handle:
+            handle.write(header + b"".join(parts))
+        os.replace(path + ".tmp", path)
+
+    def restore_checkpoint(self, path: str) -> None:
+        with open(path, "rb") as handle:
+            data = handle.read()
+        magic, pointer, relative_base, *lengths = checkpoint_header.unpack_from(data)
+        if magic != checkpoint_magic:
+            raise ValueError("Not an Intcode checkpoint")
+        parts = []
+        start = checkpoint_header.size
+        for length in lengths:
+            parts.append(program_from_image(data[start : start + length]))
+            start += length
+        self.array, inputs, self.output = parts
+        self.inputs = deque(inputs)
+        self.pointer = pointer
+        self.relative_base = relative_base
+        self.shared_memory = False
+        self.block_cache = None
+        self.fusion_table = None
+
+
+# Parsed instructions, keyed by the raw value. The same few hundred values are
+# executed over and over, so every one is only parsed (and checked) once.
+decoded_instructions = {}
+
+
+def parse_modes(value: int) -> (int, List[int]):
+    if value in decoded_instructions:
+        return decoded_instructions[value]
+    opcode = int(str(value)[-2:])
+    if opcode not in valid_opcodes:
+        raise ValueError(f"Invalid opcode {opcode}")
+    modes = [int(val) for val in str(value)[:-2]]
+    for i in range(mode_lengths[opcode] - len(modes)):
+        modes.insert(0, 0)
+    modes = modes[::-1]
+    if any(mode not in [0, 1, 2] for mode in modes[: mode_lengths[opcode]]):
+        raise ValueError(f"Wrong mode in instruction {value}")
+    if (opcode in writing_opcodes) and (modes[mode_lengths[opcode] - 1] == 1):
+        raise ValueError(f"Mode 1 is not valid for the output of opcode {opcode}")
+    decoded_instructions[value] = opcode, modes
+    return decoded_instructions[value]
+
+
+def grow_memory(array: List[int], pointer: int, relative_base: int) -> None:
+    # Memory only holds the program (plus any extra_memory asked for) and is
+    # grown here once an instruction touches an address past its end. It at
+    # least doubles, so growing costs O(1) per touched address on average.
+    needed = pointer + 4
+    if needed <= len(array):
+        opcode, modes = parse_modes(array[pointer])
+        for offset, mode in enumerate(modes[: mode_lengths[opcode]], 1):
+            if mode == 0:
+                needed = max(needed, array[pointer + offset] + 1)
+            elif mode == 2:
+                needed = max(needed, array[pointer + offset] + relative_base + 1)
+        if needed <= len(array):
+            raise ValueError(f"Negative address in instruction at {pointer}")
+    array.extend([0] * max(needed - len(array), len(array)))
+
+
+def compact_memory(puzzle_input: List[int]):
+    # Memory of machine words (8 bytes each) instead of Python ints. Only
+    # continue_program_till_no_input_or_halt keeps it that way: the first
+    # value that does not fit in 64 bits turns it back into a list. Programs
+    # with such values to begin with just stay a list.
+    try:
+        return array.array("q", puzzle_input)
+    except OverflowError:
+        return puzzle_input
+
+
+def initiate_program(
+    puzzle_input: List[int],
+    input_list: List[int],
+    extra_memory: int = 0,
+    compact: bool = False,
+) -> Program:
+    return Program(
+        array=compact_memory(puzzle_input) if compact else puzzle_input,
+        pointer=0,
+        inputs=input_list,
+        relative_base=0,
+        extra_memory=extra_memory,
+    )
+
+
+def continue_program_till_no_input_or_halt(
+    program: Program, last_step: int, budget: int = None
+) -> (Program, int):
+    # The whole interpreter lives in this one loop: pointer, relative base and
+    # memory are kept in locals and only written back to the program when it
+    # halts or waits for input. Every parameter is resolved to an address, so
+    # immediate parameters just point at the instruction itself. Instructions
+    # only change state after all their memory accesses succeeded, so after
+    # growing the memory the failed instruction can simply be run again. With
+    # a budget, the program also returns (with last_step 0) after that many
+    # jumps, so the caller gets to look at it during long computations (which
+    # all loop) as well. Counting only jumps keeps the loop as fast as before.
+    if last_step == 99:
+        return program, last_step
+    if getattr(program, "shared_memory", False):
+        program.array = program.array[:]
+        program.shared_memory = False
+    array = program.array
+    inputs = program.inputs
+    output = program.output
+    pointer = program.pointer
+    relative_base = program.relative_base
+    countdown = -1 if budget is None else budget
+    while True:
+        try:
+            opcode, modes = parse_modes(array[pointer])
+            if opcode == 99:
+                last_step = 99
+                break
+            if (opcode == 3) and not inputs:
+                last_step = -1
+                break
+
+            first = pointer + 1
+            if modes[0] == 0:
+                first = array[first]
+            elif modes[0] == 2:
+                first = array[first] + relative_base
+            if opcode == 3:
+                array[first] = inputs[0]
+                inputs.popleft()
+                pointer += 2
+                continue
+            if opcode == 4:
+                output.append(array[first])
+                pointer += 2
+                continue
+            if opcode == 9:
+                relative_base += array[first]
+                pointer += 2
+                continue
+
+            second = pointer + 2
+            if modes[1] == 0:
+                second = array[second]
+            elif modes[1] == 2:
+                second = array[second] + relative_base
+            if opcode == 5:
+                pointer = array[second] if array[first] != 0 else pointer + 3
+                countdown -= 1
+                if countdown == 0:
+                    last_step = 0
+                    break
+                continue
+            if opcode == 6:
+                pointer = array[second] if array[first] == 0 else pointer + 3
+                countdown -= 1
+                if countdown == 0:
+                    last_step = 0
+                    break
+                continue
+
+            third = pointer + 3
+            if modes[2] == 0:
+                third = array[third]
+            elif modes[2] == 2:
+                third = array[third] + relative_base
+            if opcode == 1:
+                array[third] = array[first] + array[second]
+            elif opcode == 2:
+                array[third] = array[first] * array[second]
+            elif opcode == 7:
+                array[third] = 1 if array[first] < array[second] else 0
+            else:
+                array[third] = 1 if array[first] == array[second] else 0
+            pointer += 4
+        except IndexError:
+            grow_memory(array, pointer, relative_base)
+        except OverflowError:
+            # Compact memory can not hold the value, switch to a list.
+            array = list(array)
+    program.array = array
+    program.pointer = pointer
+    program.relative_base = relative_base
+    return program, last_step
+
+
+def poll_input(
+    program: Program, last_step: int, idle_input: int = -1
+) -> (Program, int, bool):
+    # Runs a program that waits for input with idle_input (the "no input" of
+    # polling programs) till it waits again. If it wrote nothing and came back
+    # to the same instruction with the same memory and relative base, it would
+    # do just that on every further idle_input, so it can be parked until real
+    # input arrives. That is the third value returned.
+    before = program.pointer, program.relative_base, program.array[:]
+    written = len(program.output)
+    program.push_input(idle_input)
+    program, last_step = continue_program_till_no_input_or_halt(program, last_step)
+    parked = (len(program.output) == written) and (
+        before == (program.pointer, program.relative_base, program.array)
+    )
+    return program, last_step, parked
+
+
+####################################################################
+
+
+#################### PROGRAM IMAGES ############################
+# A program can be stored as a binary image instead of text, which loads
+# without parsing a single number:
+#   header: image_magic, number of words, number of big words
+#   words: one signed 64 bit integer each (in the byte order of the machine)
+#   big words: address and byte length (64 bit each), then the value itself
+# Words that do not fit in 64 bits are stored as 0 and then patched with
+# their value from the big words.
+
+image_magic = b"INTCODE\x01"
+image_header = struct.Struct("=8sqq")
+
+# A checkpoint of a program (see Program.checkpoint) is a header of
+# checkpoint_magic, pointer, relative base and the byte lengths of three
+# images: memory, queued inputs and output.
+checkpoint_magic = b"INTCKPT\x01"
+checkpoint_header = struct.Struct("=8sqqqqq")
+
+
+def image_from_program(puzzle_input: List[int]) -> bytes:
+    words = array.array("q")
+    big_words = []
+    for address, value in enumerate(puzzle_input):
+        if -(1 << 63) <= value < (1 << 63):
+            words.append(value)
+        else:
+            words.append(0)
+            length = (value.bit_length() + 8) // 8
+            big_words.append(struct.pack("=qq", address, length))
+            big_words.append(value.to_bytes(length, "little", signed=True))
+    header = image_header.pack(image_magic, len(words), len(big_words) // 2)
+    return header + words.tobytes() + b"".join(big_words)
+
+
+def program_from_image(image) -> List[int]:
+    # image is anything that supports the buffer protocol, like bytes or mmap.
+    image = memoryview(image)
+    magic, length, big_count = image_header.unpack_from(image)
+    if magic != image_magic:
+        raise ValueError("Not an Intcode program image")
+    start = image_header.size
+    words = array.array("q")
+    words.frombytes(image[start : start + 8 * length])
+    puzzle_input = words.tolist()
+    start += 8 * length
+    for _ in range(big_count):
+        address, size = struct.unpack_from("=qq", image, start)
+        start += 16
+        value = int.from_bytes(image[start : start + size], "little", signed=True)
+        puzzle_input[address] = value
+        start += size
+    return puzzle_input
+
+
+def save_image(puzzle_input: List[int], path: str) -> None:
+    with open(path, "wb") as handle:
+        handle.write(image_from_program(puzzle_input))
+
+
+def load_image(path: str) -> List[int]:
+    with open(path, "rb") as handle:
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            return program_from_image(image)
+
+
+class Checkpoints:
+    # Checkpoints.run is a drop-in replacement for
+    # continue_program_till_no_input_or_halt (also for the programs of the
+    # days) that checkpoints the program to path at most every seconds. The
+    # clock is checked whenever the program waits for input or halts, and
+    # every check_every jumps in between, so long computations get
+    # checkpointed as well. A checkpoint only holds the program: a day that
+    # keeps state of its own (a board, say) has to save that itself.
+    def __init__(self, path: str, seconds: float, check_every: int = 1 << 16):
+        self.path = path
+        self.seconds = seconds
+        self.check_every = check_every
+        self.last_checkpoint = time.monotonic()
+
+    def checkpoint(self, program: Program) -> None:
+        Program.checkpoint(program, self.path)
+        self.last_checkpoint = time.monotonic()
+
+    def run(self, program: Program, last_step: int) -> (Program, int):
+        while True:
+            program, last_step = continue_program_till_no_input_or_halt(
+                program, last_step, self.check_every
+            )
+            if time.monotonic() - self.last_checkpoint >= self.seconds:
+                self.checkpoint(program)
+            if last_step != 0:
+                return program, last_step
+
+
+def read_program(data: bytes) -> List[int]:
+    # Reads a program given either as text or as an image.
+    if data.startswith(image_magic):
+        return program_from_image(data)
+    return [int(x) for x in data.decode().split(",")]
+
+
+#################### COROUTINE ############################
+def run_as_generator(program: Program) -> Generator[int, int, None]:
+    # The program as a coroutine: every output is yielded, and a value passed
+    # in with send() is queued as input. When the program needs an input it
+    # does not have yet, it yields None. Prime it with next() first. Pointer
+    # and relative base are written back to the program once it halts.
+    if getattr(program, "shared_memory", False) or not isinstance(program.array, list):
+        program.array = list(program.array)
+        program.shared_memory = False
+    array = program.array
+    inputs = program.inputs
+    pointer = program.pointer
+    relative_base = program.relative_base
+    while True:
+        try:
+            opcode, modes = parse_modes(array[pointer])
+            if opcode == 99:
+                program.pointer = pointer
+                program.relative_base = relative_base
+                return
+
+            first = pointer + 1
+            if modes[0] == 0:
+                first = array[first]
+            elif modes[0] == 2:
+                first = array[first] + relative_base
+            if opcode == 3:
+                while not inputs:
+                    received = yield None
+                    if received is not None:
+                        inputs.append(received)
+                array[first] = inputs[0]
+                inputs.popleft()
+                pointer += 2
+                continue
+            if opcode == 4:
+                received = yield array[first]
+                if received is not None:
+                    inputs.append(received)
+                pointer += 2
+                continue
+            if opcode == 9:
+                relative_base += array[first]
+                pointer += 2
+                continue
+
+            second = pointer + 2
+            if modes[1] == 0:
+                second = array[second]
+            elif modes[1] == 2:
+                second = array[second] + relative_base
+            if opcode == 5:
+                pointer = array[second] if array[first] != 0 else pointer + 3
+                continue
+            if opcode == 6:
+                pointer = array[second] if array[first] == 0 else pointer + 3
+                continue
+
+            third = pointer + 3
+            if modes[2] == 0:
+                third = array[third]
+            elif modes[2] == 2:
+                third = array[third] + relative_base
+            if opcode == 1:
+                array[third] = array[first] + array[second]
+            elif opcode == 2:
+                array[third] = array[first] * array[second]
+            elif opcode == 7:
+                array[third] = 1 if array[first] < array[second] else 0
+            else:
+                array[third] = 1 if array[first] == array[second] else 0
+            pointer += 4
+        except IndexError:
+            grow_memory(array, pointer, relative_base)
+
+
+#################### BLOCK COMPILER ############################
+# Straight-line runs of instructions (basic blocks) are translated into Python
+# functions the first time they are reached and then called directly. A block
+# runs on through conditional jumps that are not taken, and loops without
+# returning when a jump leads back to its start. A block returns (pointer,
+# relative_base, status) with status 0 to carry on, 1 when memory has to grow
+# (the pointer is then the instruction to run again), and -1 / 99 like
+# continue_program_till_no_input_or_halt.
+
+max_block_length = 64
+
+
+class BlockCache:
+    def __init__(self, array: List[int]):
+        # The memory the blocks were compiled from. Forks and restored programs
+        # get memory of their own, and with it a cache of their own.
+        self.array = array
+        self.blocks = {}
+        self.extents = {}
+        # Address -> entries of the blocks whose code covers that address.
+        self.code = {}
+        # Address -> entries of the blocks writing there without a check.
+        self.unchecked_writes = {}
+
+    def drop(self, entry: int) -> None:
+        if entry not in self.blocks:
+            return
+        del self.blocks[entry]
+        for address in set(self.extents.pop(entry)):
+            self.code[address].discard(entry)
+            if not self.code[address]:
+                del self.code[address]
+
+    def invalidate(self, address: int) -> None:
+        for entry in list(self.code.get(address, [])):
+            self.drop(entry)
+
+    def compile(self, array: List[int], entry: int, relative_base: int):
+        if entry + 4 > len(array):
+            grow_memory(array, entry, relative_base)
+        # Translate once to find the code of the block, then again knowing
+        # which fixed write targets are code and need a check.
+        covered = set(translate_block(array, entry, lambda target: True).covered)
+        block = translate_block(
+            array, entry, lambda target: (target in self.code) or (target in covered)
+        )
+        # Fixed addresses are made to fit now, so only accesses relative to the
+        # relative base can still run out of memory.
+        largest = max(block.fixed_addresses, default=0)
+        if largest >= len(array):
+            array.extend([0] * max(largest + 1 - len(array), len(array)))
+        # Blocks writing into this code without a check need one from now on.
+        for address in block.covered:
+            for writer in self.unchecked_writes.pop(address, []):
+                self.drop(writer)
+
+        header = "def block(a, rb, inputs, output, code, invalidate):"
+        source = "\n".join(
+            [header, f"    pc = {entry}", "    try:", "        while True:"]
+            + ["            " + line for line in block.lines]
+            + ["    except IndexError:", "        return pc, rb, 1"]
+        )
+        namespace = {}
+        exec(compile(source, f"<block {entry}>", "exec"), namespace)
+        self.blocks[entry] = namespace["block"]
+        self.extents[entry] = block.covered
+        for address in block.covered:
+            self.code.setdefault(address, set()).add(entry)
+        for target in block.unchecked:
+            self.unchecked_writes.setdefault(target, set()).add(entry)
+        return self.blocks[entry]
+
+
+def read_parameter(array: List[int], address: int, mode: int) -> str:
+    if mode == 0:
+        return f"a[{array[address]}]"
+    if mode == 1:
+        return str(array[address])
+    return f"a[rb + {array[address]}]"
+
+
+def write_instruction(
+    array: List[int],
+    address: int,
+    mode: int,
+    value: str,
+    needs_check,
+    then: List[str] = [],
+) -> (List[str], List[int]):
+    # A write that may hit compiled code checks for it. If it did, the blocks
+    # covering that address are dropped and this block stops right after the
+    # write, so the modified code is compiled afresh before it runs. Returns
+    # the lines and the fixed target if it was left unchecked.
+    next_pointer = address + 1
+    if mode == 0:
+        target = str(array[address])
+        lines = [f"a[{target}] = {value}"] + then
+        if not needs_check(array[address]):
+            return lines, [array[address]]
+    else:
+        target = "t"
+        lines = [f"t = rb + {array[address]}", f"a[t] = {value}"] + then
+    return (
+        lines
+        + [
+            f"if {target} in code:",
+            f"    invalidate({target})",
+            f"    return {next_pointer}, rb, 0",
+        ],
+        [],
+    )
+
+
+def translate_jump(
+    array: List[int], pointer: int, opcode: int, modes: List[int], entry: int
+) -> (List[str], int):
+    # Returns the lines for a jump and where translation carries on (None if
+    # the block ends here). A jump back to the entry of the block becomes a
+    # "continue" of its loop and a jump that is always taken to a fixed address
+    # is followed, so tight loops run inside a single call.
+    condition = read_parameter(array, pointer + 1, modes[0])
+    condition = f"{condition} != 0" if opcode == 5 else f"{condition} == 0"
+    target = read_parameter(array, pointer + 2, modes[1])
+    exit_line = "continue" if target == str(entry) else f"return {target}, rb, 0"
+    if modes[0] == 1:
+        if (array[pointer + 1] != 0) != (opcode == 5):
+            return [], pointer + 3
+        if (modes[1] == 1) and (target != str(entry)):
+            return [], array[pointer + 2]
+        return [exit_line], None
+    return [f"if {condition}:", f"    {exit_line}"], pointer + 3
+
+
+class Translation(NamedTuple):
+    lines: List[str]
+    covered: List[int]
+    unchecked: List[int]
+    fixed_addresses: List[int]
+
+
+def translate_block(array: List[int], entry: int, needs_check) -> Translation:
+    lines = []
+    covered = []
+    unchecked = []
+    fixed_addresses = []
+    pointer = entry
+    for i in range(max_block_length):
+        if pointer == entry and covered:
+            # Followed a jump back around to the start.
+            lines.append("continue")
+            return Translation(lines, covered, unchecked, fixed_addresses)
+        if pointer in covered:
+            break
+        try:
+            opcode, modes = parse_modes(array[pointer])
+        except (IndexError, ValueError):
+            if pointer == entry:
+                raise
+            break
+        length = mode_lengths[opcode]
+        if pointer + length >= len(array):
+            break
+        params = [
+            read_parameter(array, pointer + offset, mode)
+            for offset, mode in enumerate(modes[:length], 1)
+        ]
+        next_pointer = pointer + length + 1
+        covered.extend(range(pointer, next_pointer))
+        fixed_addresses += [
+            array[pointer + offset]
+            for offset, mode in enumerate(modes[:length], 1)
+            if mode == 0
+        ]
+        if 2 in modes[:length]:
+            # Only accesses relative to the relative base can fail.
+            lines.append(f"pc = {pointer}")
+        write = None
+        if opcode == 1:
+            write = f"{params[0]} + {params[1]}"
+        elif opcode == 2:
+            write = f"{params[0]} * {params[1]}"
+        elif opcode == 3:
+            lines += ["if not inputs:", f"    return {pointer}, rb, -1"]
+            write_lines, targets = write_instruction(
+                array,
+                pointer + 1,
+                modes[0],
+                "inputs[0]",
+                needs_check,
+                ["inputs.popleft()"],
+            )
+            lines += write_lines
+            unchecked += targets
+        elif opcode == 4:
+            lines.append(f"output.append({params[0]})")
+        elif opcode in [5, 6]:
+            jump_lines, next_pointer = translate_jump(
+                array, pointer, opcode, modes, entry
+            )
+            lines += jump_lines
+            if next_pointer is None:
+                return Translation(lines, covered, unchecked, fixed_addresses)
+        elif opcode == 7:
+            write = f"1 if {params[0]} < {params[1]} else 0"
+        elif opcode == 8:
+            write = f"1 if {params[0]} == {params[1]} else 0"
+        elif opcode == 9:
+            lines.append(f"rb += {params[0]}")
+        else:
+            lines.append(f"return {pointer}, rb, 99")
+            return Translation(lines, covered, unchecked, fixed_addresses)
+        if write is not None:
+            write_lines, targets = write_instruction(
+                array, pointer + 3, modes[2], write, needs_check
+            )
+            lines += write_lines
+            unchecked += targets
+        pointer = next_pointer
+    lines.append(f"return {pointer}, rb, 0")
+    return Translation(lines, covered, unchecked, fixed_addresses)
+
+
+def run_compiled(program: Program, last_step: int) -> (Program, int):
+    # Drop-in replacement for continue_program_till_no_input_or_halt that runs
+    # compiled blocks. They are cached per program by their entry address.
+    if last_step == 99:
+        return program, last_step
+    if getattr(program, "shared_memory", False) or not isinstance(program.array, list):
+        program.array = list(program.array)
+        program.shared_memory = False
+    cache = getattr(program, "block_cache", None)
+    if (cache is None) or (cache.array is not program.array):
+        cache = program.block_cache = BlockCache(program.array)
+    blocks = cache.blocks
+    array = program.array
+    inputs = program.inputs
+    output = program.output
+    pointer = program.pointer
+    relative_base = program.relative_base
+    while True:
+        block = blocks.get(pointer)
+        if block is None:
+            block = cache.compile(array, pointer, relative_base)
+        pointer, relative_base, status = block(
+            array, relative_base, inputs, output, cache.code, cache.invalidate
+        )
+        if status == 1:
+            grow_memory(array, pointer, relative_base)
+        elif status != 0:
+            last_step = status
+            break
+    program.pointer = pointer
+    program.relative_base = relative_base
+    return program, last_step
+
+
+#################### SUPERINSTRUCTIONS ############################
+# A peephole pass over the program fuses pairs of instructions that programs
+# keep using together, so each pair is run in a single dispatch:
+# - a compare (7, 8) whose result is tested by the jump (5, 6) right after it
+# - a relative base adjustment (9) followed by an add or multiply
+# A pair that gets written to is dropped, and its instructions are run one by
+# one from then on.
+
+
+class Fused(NamedTuple):
+    first_opcode: int
+    first_modes: List[int]
+    second_opcode: int
+    second_modes: List[int]
+    # Address of the second instruction and of the one after the pair.
+    second: int
+    end: int
+
+
+def fuse_instructions(array: List[int]) -> Dict[int, Fused]:
+    fused = {}
+    pointer = 0
+    while pointer < len(array):
+        try:
+            opcode, modes = parse_modes(array[pointer])
+            second = pointer + mode_lengths[opcode] + 1
+            second_opcode, second_modes = parse_modes(array[second])
+        except (IndexError, ValueError):
+            pointer += 1
+            continue
+        end = second + mode_lengths[second_opcode] + 1
+        if end > len(array):
+            break
+        compare_then_jump = (
+            (opcode in [7, 8])
+            and (second_opcode in [5, 6])
+            and (modes[2] == second_modes[0])
+            and (array[pointer + 3] == array[second + 1])
+        )
+        base_then_arithmetic = (opcode == 9) and (second_opcode in [1, 2])
+        if compare_then_jump or base_then_arithmetic:
+            fused[pointer] = Fused(
+                opcode, modes, second_opcode, second_modes, second, end
+            )
+            pointer = end
+        else:
+            pointer = second
+    return fused
+
+
+class FusionTable:
+    def __init__(self, array: List[int]):
+        self.fused = fuse_instructions(array)
+        # Address -> start of the fused pair it belongs to.
+        self.covered = {}
+        for start, pair in self.fused.items():
+            for address in range(start, pair.end):
+                self.covered[address] = start
+        self.dispatches = 0
+        self.instructions = 0
+
+    def drop(self, address: int) -> None:
+        start = self.covered[address]
+        for covered in range(start, self.fused.pop(start).end):
+            del self.covered[covered]
+
+
+# Dispatches and executed instructions of all runs of run_fused.
+fusion_totals = {"dispatches": 0, "instructions": 0}
+
+
+def run_fused(program: Program, last_step: int) -> (Program, int):
+    # Drop-in replacement for continue_program_till_no_input_or_halt that runs
+    # fused pairs in one dispatch. Dispatches and executed instructions are
+    # counted on the fusion table, which is kept per program, and summed up
+    # over all programs in fusion_totals.
+    if last_step == 99:
+        return program, last_step
+    if getattr(program, "shared_memory", False) or not isinstance(program.array, list):
+        program.array = list(program.array)
+        program.shared_memory = False
+    if getattr(program, "fusion_table", None) is None:
+        program.fusion_table = FusionTable(program.array)
+    table = program.fusion_table
+    fused = table.fused
+    covered = table.covered
+    array = program.array
+    inputs = program.inputs
+    output = program.output
+    pointer = program.pointer
+    relative_base = program.relative_base
+    dispatches = 0
+    pairs = 0
+    while True:
+        try:
+            dispatches += 1
+            pair = fused.get(pointer)
+            if pair is not None:
+                # Like below, nothing is written before every read succeeded,
+                # so a pair that runs out of memory can simply be run again.
+                if pair.first_opcode == 9:
+                    base = pointer + 1
+                    if pair.first_modes[0] == 0:
+                        base = array[base]
+                    elif pair.first_modes[0] == 2:
+                        base = array[base] + relative_base
+                    base = relative_base + array[base]
+                    modes = pair.second_modes
+                    first = pair.second + 1
+                    if modes[0] == 0:
+                        first = array[first]
+                    elif modes[0] == 2:
+                        first = array[first] + base
+                    second = pair.second + 2
+                    if modes[1] == 0:
+                        second = array[second]
+                    elif modes[1] == 2:
+                        second = array[second] + base
+                    third = pair.second + 3
+                    if modes[2] == 0:
+                        third = array[third]
+                    elif modes[2] == 2:
+                        third = array[third] + base
+                    if pair.second_opcode == 1:
+                        array[third] = array[first] + array[second]
+                    else:
+                        array[third] = array[first] * array[second]
+                    relative_base = base
+                    pointer = pair.end
+                    pairs += 1
+                    if third in covered:
+                        table.drop(third)
+                    continue
+
+                modes = pair.first_modes
+                first = pointer + 1
+                if modes[0] == 0:
+                    first = array[first]
+                elif modes[0] == 2:
+                    first = array[first] + relative_base
+                second = pointer + 2
+                if modes[1] == 0:
+                    second = array[second]
+                elif modes[1] == 2:
+                    second = array[second] + relative_base
+                third = pointer + 3
+                if modes[2] == 0:
+                    third = array[third]
+                elif modes[2] == 2:
+                    third = array[third] + relative_base
+                if pair.first_opcode == 7:
+                    array[third] = 1 if array[first] < array[second] else 0
+                else:
+                    array[third] = 1 if array[first] == array[second] else 0
+                # The compare is done, so from here on the jump is retried on
+                # its own. The same goes for a compare that rewrote the pair.
+                pointer = pair.second
+                if third in covered:
+                    table.drop(third)
+                    continue
+                if (array[third] != 0) == (pair.second_opcode == 5):
+                    target = pointer + 2
+                    if pair.second_modes[1] == 0:
+                        target = array[target]
+                    elif pair.second_modes[1] == 2:
+                        target = array[target] + relative_base
+                    pointer = array[target]
+                else:
+                    pointer = pair.end
+                pairs += 1
+                continue
+
+            opcode, modes = parse_modes(array[pointer])
+            if opcode == 99:
+                last_step = 99
+                break
+            if (opcode == 3) and not inputs:
+                last_step = -1
+                break
+
+            first = pointer + 1
+            if modes[0] == 0:
+                first = array[first]
+            elif modes[0] == 2:
+                first = array[first] + relative_base
+            if opcode == 3:
+                array[first] = inputs[0]
+                inputs.popleft()
+                if first in covered:
+                    table.drop(first)
+                pointer += 2
+                continue
+            if opcode == 4:
+                output.append(array[first])
+                pointer += 2
+                continue
+            if opcode == 9:
+                relative_base += array[first]
+                pointer += 2
+                continue
+
+            second = pointer + 2
+            if modes[1] == 0:
+                second = array[second]
+            elif modes[1] == 2:
+                second = array[second] + relative_base
+            if opcode == 5:
+                pointer = array[second] if array[first] != 0 else pointer + 3
+                continue
+            if opcode == 6:
+                pointer = array[second] if array[first] == 0 else pointer + 3
+                continue
+
+            third = pointer + 3
+            if modes[2] == 0:
+                third = array[third]
+            elif modes[2] == 2:
+                third = array[third] + relative_base
+            if opcode == 1:
+                array[third] = array[first] + array[second]
+            elif opcode == 2:
+                array[third] = array[first] * array[second]
+            elif opcode == 7:
+                array[third] = 1 if array[first] < array[second] else 0
+            else:
+                array[third] = 1 if array[first] == array[second] else 0
+            if third in covered:
+                table.drop(third)
+            pointer += 4
+        except IndexError:
+            dispatches -= 1
+            if pointer in fused:
+                # Let the two instructions grow the memory one at a time.
+                table.drop(pointer)
+            else:
+                grow_memory(array, pointer, relative_base)
+    # The last dispatch only found a halt or a missing input.
+    dispatches -= 1
+    program.pointer = pointer
+    program.relative_base = relative_base
+    table.dispatches += dispatches
+    table.instructions += dispatches + pairs
+    fusion_totals["dispatches"] += dispatches
+    fusion_totals["instructions"] += dispatches + pairs
+    return program, last_step
+
+
+#################### LOCKSTEP BATCHES ############################
+# Runs many copies (lanes) of a program side by side. Memory is stored by
+# address: memory[address] holds the value of that address for every lane of
+# a batch, so one instruction is decoded once and carried out for all lanes
+# in a single list comprehension. When lanes stop agreeing on where to go
+# next (a different instruction, jump or relative base), the batch is split
+# into one batch per destination. Lanes can not wait for input.
+
+
+class Lane(NamedTuple):
+    memory: List[int]
+    output: List[int]
+
+
+class Batch:
+    def __init__(
+        self,
+        lanes: List[int],
+        memory: List[List[int]],
+        pointer: int,
+        relative_base: int,
+        inputs_used: int,
+    ):
+        self.lanes = lanes
+        self.memory = memory
+        self.pointer = pointer
+        self.relative_base = relative_base
+        self.inputs_used = inputs_used
+
+    def split(self, keys: List[int]) -> Dict[int, "Batch"]:
+        # One batch for every distinct key, holding the lanes with that key.
+        groups = {}
+        for index, key in enumerate(keys):
+            groups.setdefault(key, []).append(index)
+        return {
+            key: Batch(
+                [self.lanes[index] for index in indices],
+                [[column[index] for index in indices] for column in self.memory],
+                self.pointer,
+                self.relative_base,
+                self.inputs_used,
+            )
+            for key, indices in groups.items()
+        }
+
+
+def lane_addresses(batch: Batch, address: int, mode: int) -> (int, List[int]):
+    # Resolves a parameter to one address shared by all lanes, or to a list
+    # with one address per lane (the other one is None).
+    if mode == 1:
+        return address, None
+    addresses = batch.memory[address]
+    if mode == 2:
+        addresses = [value + batch.relative_base for value in addresses]
+    if addresses.count(addresses[0]) == len(addresses):
+        if addresses[0] < 0:
+            raise ValueError(f"Negative address in instruction at {batch.pointer}")
+        grow_columns(batch, addresses[0])
+        return addresses[0], None
+    if min(addresses) < 0:
+        raise ValueError(f"Negative address in instruction at {batch.pointer}")
+    grow_columns(batch, max(addresses))
+    return None, addresses
+
+
+def grow_columns(batch: Batch, address: int) -> None:
+    lanes = len(batch.lanes)
+    while address >= len(batch.memory):
+        batch.memory.append([0] * lanes)
+
+
+def read_lanes(batch: Batch, address: int, addresses: List[int]) -> List[int]:
+    if addresses is None:
+        return batch.memory[address]
+    memory = batch.memory
+    return [memory[address][lane] for lane, address in enumerate(addresses)]
+
+
+def write_lanes(
+    batch: Batch, address: int, addresses: List[int], values: List[int]
+) -> None:
+    if addresses is None:
+        batch.memory[address] = values
+    else:
+        memory = batch.memory
+        for lane, address in enumerate(addresses):
+            memory[address][lane] = values[lane]
+
+
+def run_lockstep(
+    memory: List[List[int]],
+    lane_inputs: List[List[int]],
+    pointer: int = 0,
+    relative_base: int = 0,
+) -> List[Lane]:
+    # Runs every lane with its inputs until it halts, starting all of them at
+    # the same pointer and relative base. memory[address][lane] is the start
+    # memory of the lanes, and is used up by the run.
+    lanes = list(range(len(lane_inputs)))
+    batches = [Batch(lanes, memory, pointer, relative_base, 0)]
+    results = [None] * len(lanes)
+    outputs = [[] for _ in lanes]
+    while batches:
+        batch = batches.pop()
+        while True:
+            grow_columns(batch, batch.pointer + 3)
+            instructions = batch.memory[batch.pointer]
+            if instructions.count(instructions[0]) != len(instructions):
+                batches.extend(batch.split(instructions).values())
+                break
+            opcode, modes = parse_modes(instructions[0])
+            pointer = batch.pointer
+            if opcode == 99:
+                for lane, memory in zip(batch.lanes, zip(*batch.memory)):
+                    results[lane] = Lane(list(memory), outputs[lane])
+                break
+
+            first, firsts = lane_addresses(batch, pointer + 1, modes[0])
+            if opcode == 3:
+                values = []
+                for lane in batch.lanes:
+                    if batch.inputs_used == len(lane_inputs[lane]):
+                        raise ValueError(f"Lane {lane} ran out of input")
+                    values.append(lane_inputs[lane][batch.inputs_used])
+                batch.inputs_used += 1
+                write_lanes(batch, first, firsts, values)
+                batch.pointer += 2
+                continue
+            x = read_lanes(batch, first, firsts)
+            if opcode == 4:
+                for lane, value in zip(batch.lanes, x):
+                    outputs[lane].append(value)
+                batch.pointer += 2
+                continue
+            if opcode == 9:
+                batch.pointer += 2
+                if x.count(x[0]) != len(x):
+                    bases = [batch.relative_base + value for value in x]
+                    for base, part in batch.split(bases).items():
+                        part.relative_base = base
+                        batches.append(part)
+                    break
+                batch.relative_base += x[0]
+                continue
+
+            second, seconds = lane_addresses(batch, pointer + 2, modes[1])
+            y = read_lanes(batch, second, seconds)
+            if opcode in [5, 6]:
+                jump = opcode == 5
+                targets = [
+                    target if (value != 0) == jump else pointer + 3
+                    for value, target in zip(x, y)
+                ]
+                if targets.count(targets[0]) != len(targets):
+                    for target, part in batch.split(targets).items():
+                        part.pointer = target
+                        batches.append(part)
+                    break
+                batch.pointer = targets[0]
+                continue
+
+            third, thirds = lane_addresses(batch, pointer + 3, modes[2])
+            if opcode == 1:
+                values = [a + b for a, b in zip(x, y)]
+            elif opcode == 2:
+                values = [a * b for a, b in zip(x, y)]
+            elif opcode == 7:
+                values = [1 if a < b else 0 for a, b in zip(x, y)]
+            else:
+                values = [1 if a == b else 0 for a, b in zip(x, y)]
+            write_lanes(batch, third, thirds, values)
+            batch.pointer += 4
+    return results
+
+
+#################### PROCESS POOL ############################
+# run_many runs independent jobs of one program on a pool of processes. The
+# program is sent to every worker once, when the worker starts, so a job is
+# only its inputs (and the memory words it changes). Finished programs are
+# yielded as soon as their chunk of jobs is done, in completion order.
+
+worker_program = None
+
+
+def start_worker(puzzle_input: List[int]) -> None:
+    global worker_program
+    worker_program = puzzle_input
+
+
+def run_jobs(
+    first_index: int, jobs: List[List[int]], patches: List[Dict[int, int]]
+) -> List[Tuple[int, Program]]:
+    finished = []
+    for index, (input_list, patch) in enumerate(zip(jobs, patches), first_index):
+        program = initiate_program(worker_program, input_list)
+        for address, value in patch.items():
+            program.array[address] = value
+        program, last_step = continue_program_till_no_input_or_halt(program, 0)
+        finished.append((index, program))
+    return finished
+
+
+def run_many(
+    puzzle_input: List[int],
+    jobs: List[List[int]],
+    workers: int = None,
+    patches: List[Dict[int, int]] = None,
+    until: Callable[[Program], bool] = None,
+    chunk_size: int = 64,
+) -> Iterator[Tuple[int, Program]]:
+    # Yields (job index, finished program) for every job, each job being a
+    # list of inputs and optionally a patch of {address: value} for memory.
+    # Once until returns True for a program, that program is the last one
+    # yielded and the jobs that did not start yet are cancelled.
+    if patches is None:
+        patches = [{}] * len(jobs)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=start_worker, initargs=(puzzle_input,)
+    )
+    try:
+        futures = [
+            executor.submit(
+                run_jobs,
+                start,
+                jobs[start : start + chunk_size],
+                patches[start : start + chunk_size],
+            )
+            for start in range(0, len(jobs), chunk_size)
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            for index, program in future.result():
+                yield index, program
+                if (until is not None) and until(program):
+                    return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+#################### WATCHPOINTS ############################
+# Watchpoints call back on every read or write of an address range. While
+# there are any, Watchpoints.run runs an instrumented copy of the interpreter
+# loop, and without any it hands over to the normal one, so unwatched runs
+# pay nothing. Read callbacks get (address, value), write callbacks get
+# (address, old value, new value). Parameters in immediate mode count as
+# reads of the instruction.
+
+
+class Watchpoints:
+    def __init__(self):
+        # Address -> callbacks
+        self.reads = {}
+        self.writes = {}
+
+    def watch(
+        self,
+        start: int,
+        end: int,
+        on_read: Callable[[int, int], None] = None,
+        on_write: Callable[[int, int, int], None] = None,
+    ) -> None:
+        # Watches the addresses from start up to (not including) end.
+        for address in range(start, end):
+            if on_read is not None:
+                self.reads.setdefault(address, []).append(on_read)
+            if on_write is not None:
+                self.writes.setdefault(address, []).append(on_write)
+
+    def unwatch(self, start: int, end: int) -> None:
+        for address in range(start, end):
+            self.reads.pop(address, None)
+            self.writes.pop(address, None)
+
+    def run(self, program: Program, last_step: int) -> (Program, int):
+        if not (self.reads or self.writes):
+            return continue_program_till_no_input_or_halt(program, last_step)
+        if last_step == 99:
+            return program, last_step
+        if getattr(program, "shared_memory", False) or not isinstance(
+            program.array, list
+        ):
+            program.array = list(program.array)
+            program.shared_memory = False
+        reads = self.reads
+        writes = self.writes
+        array = program.array
+        inputs = program.inputs
+        output = program.output
+        pointer = program.pointer
+        relative_base = program.relative_base
+        while True:
+            try:
+                opcode, modes = parse_modes(array[pointer])
+                if opcode == 99:
+                    last_step = 99
+                    break
+                if (opcode == 3) and not inputs:
+                    last_step = -1
+                    break
+
+                first = pointer + 1
+                if modes[0] == 0:
+                    first = array[first]
+                elif modes[0] == 2:
+                    first = array[first] + relative_base
+                if opcode == 3:
+                    old = array[first]
+                    array[first] = inputs[0]
+                    inputs.popleft()
+                    pointer += 2
+                    for callback in writes.get(first, []):
+                        callback(first, old, array[first])
+                    continue
+                x = array[first]
+                if opcode in [4, 9]:
+                    if opcode == 4:
+                        output.append(x)
+                    else:
+                        relative_base += x
+                    pointer += 2
+                    for callback in reads.get(first, []):
+                        callback(first, x)
+                    continue
+
+                second = pointer + 2
+                if modes[1] == 0:
+                    second = array[second]
+                elif modes[1] == 2:
+                    second = array[second] + relative_base
+                y = array[second]
+                if opcode in [5, 6]:
+                    pointer = y if (x != 0) == (opcode == 5) else pointer + 3
+                    for callback in reads.get(first, []):
+                        callback(first, x)
+                    for callback in reads.get(second, []):
+                        callback(second, y)
+                    continue
+
+                third = pointer + 3
+                if modes[2] == 0:
+                    third = array[third]
+                elif modes[2] == 2:
+                    third = array[third] + relative_base
+                old = array[third]
+                if opcode == 1:
+                    array[third] = x + y
+                elif opcode == 2:
+                    array[third] = x * y
+                elif opcode == 7:
+                    array[third] = 1 if x < y else 0
+                else:
+                    array[third] = 1 if x == y else 0
+                pointer += 4
+                for callback in reads.get(first, []):
+                    callback(first, x)
+                for callback in reads.get(second, []):
+                    callback(second, y)
+                for callback in writes.get(third, []):
+                    callback(third, old, array[third])
+            except IndexError:
+                grow_memory(array, pointer, relative_base)
+        program.pointer = pointer
+        program.relative_base = relative_base
+        return program, last_step
+
+
+#################### PROFILER ############################
+# Profile.run is a drop-in replacement for
+# continue_program_till_no_input_or_halt that counts every executed
+# instruction by address and raw value, and times the stretches between I/O
+# instructions. Profiling is switched on by swapping the loop, so the normal
+# interpreter does not pay anything for it.
+
+
+class Profile:
+    def __init__(self):
+        # (address, raw instruction) -> times executed
+        self.executions = {}
+        # Seconds between consecutive I/O instructions, halts and input waits.
+        self.segments = []
+
+    def run(self, program, last_step: int):
+        if last_step == 99:
+            return program, last_step
+        if getattr(program, "shared_memory", False) or not isinstance(
+            program.array, list
+        ):
+            program.array = list(program.array)
+            program.shared_memory = False
+        executions = self.executions
+        segments = self.segments
+        array = program.array
+        inputs = program.inputs
+        output = program.output
+        pointer = program.pointer
+        relative_base = program.relative_base
+        started = time.perf_counter()
+        while True:
+            try:
+                # Counted once the instruction succeeded, under the value it
+                # had before it ran (it may overwrite itself).
+                key = pointer, array[pointer]
+                opcode, modes = parse_modes(key[1])
+                if opcode == 99:
+                    last_step = 99
+                    break
+                if (opcode == 3) and not inputs:
+                    last_step = -1
+                    break
+
+                first = pointer + 1
+                if modes[0] == 0:
+                    first = array[first]
+                elif modes[0] == 2:
+                    first = array[first] + relative_base
+                if opcode in [3, 4, 9]:
+                    if opcode == 3:
+                        array[first] = inputs[0]
+                        inputs.popleft()
+                    elif opcode == 4:
+                        output.append(array[first])
+                    else:
+                        relative_base += array[first]
+                    executions[key] = executions.get(key, 0) + 1
+                    if opcode != 9:
+                        now = time.perf_counter()
+                        segments.append(now - started)
+                        started = now
+                    pointer += 2
+                    continue
+
+                second = pointer + 2
+                if modes[1] == 0:
+                    second = array[second]
+                elif modes[1] == 2:
+                    second = array[second] + relative_base
+                if opcode in [5, 6]:
+                    if (array[first] != 0) == (opcode == 5):
+                        pointer = array[second]
+                    else:
+                        pointer += 3
+                    executions[key] = executions.get(key, 0) + 1
+                    continue
+
+                third = pointer + 3
+                if modes[2] == 0:
+                    third = array[third]
+                elif modes[2] == 2:
+                    third = array[third] + relative_base
+                if opcode == 1:
+                    array[third] = array[first] + array[second]
+                elif opcode == 2:
+                    array[third] = array[first] * array[second]
+                elif opcode == 7:
+                    array[third] = 1 if array[first] < array[second] else 0
+                else:
+                    array[third] = 1 if array[first] == array[second] else 0
+                executions[key] = executions.get(key, 0) + 1
+                pointer += 4
+            except IndexError:
+                grow_memory(array, pointer, relative_base)
+        segments.append(time.perf_counter() - started)
+        program.pointer = pointer
+        program.relative_base = relative_base
+        return program, last_step
+
+    def by_opcode(self) -> Dict[int, int]:
+        counts = {}
+        for (address, value), times in self.executions.items():
+            opcode, modes = parse_modes(value)
+            counts[opcode] = counts.get(opcode, 0) + times
+        return counts
+
+    def by_mode(self) -> Dict[int, int]:
+        # How often parameters were accessed in each addressing mode.
+        counts = {}
+        for (address, value), times in self.executions.items():
+            opcode, modes = parse_modes(value)
+            for mode in modes[: mode_lengths[opcode]]:
+                counts[mode] = counts.get(mode, 0) + times
+        return counts
+
+    def by_address(self) -> Dict[int, int]:
+        counts = {}
+        for (address, value), times in self.executions.items():
+            counts[address] = counts.get(address, 0) + times
+        return counts
+
+    def report(self, hot_addresses: int = 20) -> str:
+        total = sum(self.executions.values())
+        lines = [f"Instructions: {total} in {sum(self.segments):.3f}s"]
+        if self.segments:
+            lines.append(
+                f"Between I/O: {len(self.segments)} stretches, longest "
+                f"{max(self.segments) * 1000:.3f}ms, mean "
+                f"{sum(self.segments) / len(self.segments) * 1000:.3f}ms"
+            )
+        by_opcode = sorted(self.by_opcode().items(), key=lambda item: -item[1])
+        lines.append("Opcodes:")
+        for opcode, times in by_opcode:
+            lines.append(f"{opcode:>8} {times:>12} {100 * times / total:6.2f}%")
+        lines.append("Modes:")
+        for mode, times in sorted(self.by_mode().items()):
+            lines.append(f"{mode:>8} {times:>12}")
+        by_address = sorted(self.by_address().items(), key=lambda item: -item[1])
+        lines.append("Hot addresses:")
+        for address, times in by_address[:hot_addresses]:
+            values = [value for (at, value) in self.executions if at == address]
+            lines.append(
+                f"{address:>8} {times:>12} {100 * times / total:6.2f}%  "
+                + " ".join(str(value) for value in values)
+            )
+        return "\n".join(lines)
+
+
+#################### TRACE RECORDER ############################
+# TraceRecorder.run is a drop-in replacement for
+# continue_program_till_no_input_or_halt that logs every executed instruction
+# to a binary file of 64 bit integers, written in chunks as the buffer fills
+# up. Each record has record_length words:
+#   step, opcode, pointer, first, second, address, value
+# first and second are the values the instruction read (the jump target for
+# jumps), address and value what it wrote (address -1 if nothing). With
+# every > 1 only every n-th step is logged in full, but writes are always
+# logged (as opcode 0), so memory can be rebuilt at any step. Memory that
+# changed between runs (a fork or a restore) is logged before the step as
+# opcode -2 writes, or as a whole image (opcode -1) of address words, which
+# follow the record.
+
+record_length = 7
+
+
+class TraceRecord(NamedTuple):
+    step: int
+    opcode: int
+    pointer: int
+    first: int
+    second: int
+    address: int
+    value: int
+    image: List[int] = None
+
+
+class TraceRecorder:
+    def __init__(self, path: str, every: int = 1, chunk_records: int = 1 << 16):
+        self.handle = open(path, "wb")
+        self.every = every
+        self.chunk_words = chunk_records * record_length
+        self.buffer = array.array("q")
+        self.step = 0
+        # The memory the trace is up to date with.
+        self.memory = None
+
+    def flush(self) -> None:
+        self.buffer.tofile(self.handle)
+        self.buffer = array.array("q")
+
+    def close(self) -> None:
+        self.flush()
+        self.handle.close()
+
+    def log_memory(self, memory: List[int]) -> None:
+        # The program got a new memory (a fork or a restore), so only log the
+        # words that differ from the memory the trace knows about.
+        if (self.memory is None) or (len(memory) < len(self.memory)):
+            self.buffer.extend((self.step, -1, 0, 0, 0, len(memory), 0))
+            self.buffer.extend(memory)
+        else:
+            known = self.memory + [0] * (len(memory) - len(self.memory))
+            for address, (old, new) in enumerate(zip(known, memory)):
+                if old != new:
+                    self.buffer.extend((self.step, -2, 0, 0, 0, address, new))
+        self.memory = memory
+
+    def run(self, program, last_step: int):
+        # Values have to fit in 64 bits to be logged.
+        if last_step == 99:
+            return program, last_step
+        if getattr(program, "shared_memory", False) or not isinstance(
+            program.array, list
+        ):
+            program.array = list(program.array)
+            program.shared_memory = False
+        if program.array is not self.memory:
+            self.log_memory(program.array)
+        every = self.every
+        chunk_words = self.chunk_words
+        buffer = self.buffer
+        step = self.step
+        array = program.array
+        inputs = program.inputs
+        output = program.output
+        pointer = program.pointer
+        relative_base = program.relative_base
+        while True:
+            try:
+                opcode, modes = parse_modes(array[pointer])
+                if opcode == 99:
+                    last_step = 99
+                    break
+                if (opcode == 3) and not inputs:
+                    last_step = -1
+                    break
+
+                first = pointer + 1
+                if modes[0] == 0:
+                    first = array[first]
+                elif modes[0] == 2:
+                    first = array[first] + relative_base
+                if opcode in [3, 4, 9]:
+                    second = 0
+                    address = -1
+                    if opcode == 3:
+                        value = inputs[0]
+                        array[first] = value
+                        inputs.popleft()
+                        address = first
+                    else:
+                        value = array[first]
+                        if opcode == 4:
+                            output.append(value)
+                        else:
+                            relative_base += value
+                    read = value
+                    following = pointer + 2
+                elif opcode in [5, 6]:
+                    second = pointer + 2
+                    if modes[1] == 0:
+                        second = array[second]
+                    elif modes[1] == 2:
+                        second = array[second] + relative_base
+                    read = array[first]
+                    second = array[second]
+                    address = -1
+                    value = 0
+                    if (read != 0) == (opcode == 5):
+                        following = second
+                    else:
+                        following = pointer + 3
+                else:
+                    second = pointer + 2
+                    if modes[1] == 0:
+                        second = array[second]
+                    elif modes[1] == 2:
+                        second = array[second] + relative_base
+                    address = pointer + 3
+                    if modes[2] == 0:
+                        address = array[address]
+                    elif modes[2] == 2:
+                        address = array[address] + relative_base
+                    read = array[first]
+                    second = array[second]
+                    if opcode == 1:
+                        value = read + second
+                    elif opcode == 2:
+                        value = read * second
+                    elif opcode == 7:
+                        value = 1 if read < second else 0
+                    else:
+                        value = 1 if read == second else 0
+                    array[address] = value
+                    following = pointer + 4
+            except IndexError:
+                grow_memory(array, pointer, relative_base)
+                continue
+            if step % every == 0:
+                buffer.extend((step, opcode, pointer, read, second, address, value))
+            elif address >= 0:
+                buffer.extend((step, 0, 0, 0, 0, address, value))
+            if len(buffer) >= chunk_words:
+                self.flush()
+                buffer = self.buffer
+            step += 1
+            pointer = following
+        self.step = step
+        program.pointer = pointer
+        program.relative_base = relative_base
+        return program, last_step
+
+
+def read_trace(path: str, chunk_words: int = 1 << 16) -> Iterator[TraceRecord]:
+    # Streams the records of a trace file without loading it whole.
+    def words():
+        with open(path, "rb") as handle:
+            while True:
+                chunk = array.array("q")
+                try:
+                    chunk.fromfile(handle, chunk_words)
+                except EOFError:
+                    # The last, partial chunk has still been read.
+                    yield from chunk
+                    return
+                yield from chunk
+
+    stream = words()
+    for step in stream:
+        record = TraceRecord(step, *(next(stream) for _ in range(record_length - 1)))
+        if record.opcode == -1:
+            image = [next(stream) for _ in range(record.address)]
+            record = record._replace(image=image)
+        yield record
+
+
+def memory_at(path: str, step: int) -> List[int]:
+    # Rebuilds memory as it was right before the given step, from the memory
+    # images and writes in the trace (nothing is executed).
+    memory = []
+    for record in read_trace(path):
+        if record.step > step:
+            break
+        if record.opcode == -1:
+            memory = list(record.image)
+            continue
+        if (record.step == step) and (record.opcode != -2):
+            break
+        if record.address >= 0:
+            if record.address >= len(memory):
+                memory.extend([0] * (record.address + 1 - len(memory)))
+            memory[record.address] = record.value
+    return memory
+
+
+#################### SESSION RECORDER ############################
+# SessionRecorder.run is a drop-in replacement for
+# continue_program_till_no_input_or_halt that records the inputs a program
+# consumes and the outputs it writes, so a session of an interactive day can
+# be run again without the day's controller (replay_session). A run that
+# carries on where the program stopped extends its current segment. A fresh,
+# forked or restored program starts a new segment, which keeps its memory as
+# the words that differ from the first memory recorded. Changes the controller
+# makes to memory in between runs are not recorded.
+# A session file has a session_header of session_magic, number of segments
+# and size of the image of the first memory, followed by that image and every
+# segment: a segment_header of pointer, relative base, memory length and the
+# sizes of the images of its changes (address, value pairs), inputs and
+# outputs, followed by these images.
+
+session_magic = b"INTSESS\x01"
+session_header = struct.Struct("=8sqq")
+segment_header = struct.Struct("=qqqqqq")
+
+
+class Segment(NamedTuple):
+    pointer: int
+    relative_base: int
+    length: int
+    changes: List[int]
+    inputs: List[int]
+    outputs: List[int]
+
+
+class SessionRecorder:
+    def __init__(self):
+        self.memory = None
+        self.segments = []
+        # Per program: its segment and its memory, pointer and relative base
+        # after its last run, to tell whether the next run carries on there.
+        self.ends = {}
+
+    def start_segment(self, program: Program) -> Segment:
+        if self.memory is None:
+            self.memory = list(program.array)
+        known = self.memory + [0] * (len(program.array) - len(self.memory))
+        changes = []
+        for address, (old, new) in enumerate(zip(known, program.array)):
+            if old != new:
+                changes.extend((address, new))
+        segment = Segment(
+            program.pointer, program.relative_base, len(program.array), changes, [], []
+        )
+        self.segments.append(segment)
+        return segment
+
+    def run(self, program: Program, last_step: int) -> (Program, int):
+        segment, array, pointer, relative_base = self.ends.get(
+            id(program), (None, None, None, None)
+        )
+        if (
+            (program.array is not array)
+            or (program.pointer != pointer)
+            or (program.relative_base != relative_base)
+        ):
+            segment = self.start_segment(program)
+        queued = list(program.inputs)
+        written = len(program.output)
+        program, last_step = continue_program_till_no_input_or_halt(program, last_step)
+        segment.inputs.extend(queued[: len(queued) - len(program.inputs)])
+        segment.outputs.extend(program.output[written:])
+        self.ends[id(program)] = (
+            segment,
+            program.array,
+            program.pointer,
+            program.relative_base,
+        )
+        return program, last_step
+
+    def save(self, path: str) -> None:
+        parts = [image_from_program(self.memory or [])]
+        for segment in self.segments:
+            images = [
+                image_from_program(part)
+                for part in [segment.changes, segment.inputs, segment.outputs]
+            ]
+            parts.append(
+                segment_header.pack(
+                    segment.pointer,
+                    segment.relative_base,
+                    segment.length,
+                    *[len(image) for image in images],
+                )
+            )
+            parts.extend(images)
+        header = session_header.pack(session_magic, len(self.segments), len(parts[0]))
+        with open(path, "wb") as handle:
+            handle.write(header + b"".join(parts))
+
+
+def read_session(path: str) -> (List[int], List[Segment]):
+    with open(path, "rb") as handle:
+        data = handle.read()
+    magic, count, length = session_header.unpack_from(data)
+    if magic != session_magic:
+        raise ValueError("Not an Intcode session")
+    start = session_header.size
+    memory = program_from_image(data[start : start + length])
+    start += length
+    segments = []
+    for _ in range(count):
+        pointer, relative_base, length, *sizes = segment_header.unpack_from(data, start)
+        start += segment_header.size
+        parts = []
+        for size in sizes:
+            parts.append(program_from_image(data[start : start + size]))
+            start += size
+        segments.append(Segment(pointer, relative_base, length, *parts))
+    return memory, segments
+
+
+def replay_session(
+    path: str, run=continue_program_till_no_input_or_halt
+) -> (float, bool):
+    # Runs every segment of a session with all its inputs queued up front, so
+    # only the interpreter is timed. Returns the seconds that took and whether
+    # every segment wrote the outputs that were recorded.
+    memory, segments = read_session(path)
+    programs = []
+    for segment in segments:
+        array = memory[: segment.length]
+        array.extend([0] * (segment.length - len(array)))
+        for address, value in zip(segment.changes[::2], segment.changes[1::2]):
+            array[address] = value
+        programs.append(
+            Program(array, segment.pointer, segment.inputs, segment.relative_base, 0)
+        )
+    started = time.perf_counter()
+    for program in programs:
+        run(program, 0)
+    seconds = time.perf_counter() - started
+    matched = all(
+        program.output == segment.outputs
+        for program, segment in zip(programs, segments)
+    )
+    return seconds, matched
+
+
+#################### DISASSEMBLER ############################
+# disassemble walks a program from address 0 and splits the code it reaches
+# into basic blocks. Jumps to an immediate target are followed, jumps through
+# memory (like the relative base returns of function calls) are marked
+# indirect. To still find the code a call returns to, a constant that an
+# instruction stores and that is the address right after an unconditional
+# jump is taken as a return address and walked as well. Writes to a fixed
+# address inside the code modify the program itself, writes relative to the
+# relative base might.
+
+
+class Instruction(NamedTuple):
+    address: int
+    opcode: int
+    modes: List[int]
+    parameters: List[int]
+
+
+class Block(NamedTuple):
+    start: int
+    end: int
+    successors: List[int]
+    indirect: bool
+
+
+class Disassembly(NamedTuple):
+    instructions: Dict[int, Instruction]
+    blocks: Dict[int, Block]
+    code: List[Tuple[int, int]]
+    data: List[Tuple[int, int]]
+    code_writes: List[int]
+    relative_writes: List[int]
+    invalid: List[int]
+
+
+def decode_instruction(memory: List[int], address: int) -> Instruction:
+    # None for anything that is not a valid instruction. Parameters past the
+    # end of the program are the zeros memory is grown with.
+    if not 0 <= address < len(memory):
+        return None
+    try:
+        opcode, modes = parse_modes(memory[address])
+    except ValueError:
+        return None
+    length = mode_lengths[opcode]
+    parameters = memory[address + 1 : address + 1 + length]
+    parameters += [0] * (length - len(parameters))
+    return Instruction(address, opcode, modes[:length], parameters)
+
+
+def successors(instruction: Instruction) -> (List[int], bool):
+    # The addresses execution can continue at, and whether it can also jump
+    # to an address that is only known at run time.
+    following = instruction.address + 1 + len(instruction.parameters)
+    if instruction.opcode == 99:
+        return [], False
+    if instruction.opcode not in [5, 6]:
+        return [following], False
+    condition, target = instruction.parameters
+    taken = [target] if instruction.modes[1] == 1 else []
+    indirect = instruction.modes[1] != 1
+    if instruction.modes[0] == 1:
+        if (condition != 0) == (instruction.opcode == 5):
+            return taken, indirect
+        return [following], False
+    return taken + [following], indirect
+
+
+def stored_constant(instruction: Instruction) -> int:
+    # The value an add or multiply of two immediates writes, None otherwise.
+    if (instruction.opcode not in [1, 2]) or (instruction.modes[:2] != [1, 1]):
+        return None
+    first, second = instruction.parameters[:2]
+    return first + second if instruction.opcode == 1 else first * second
+
+
+def address_ranges(addresses) -> List[Tuple[int, int]]:
+    # Sorted addresses as (start, end) ranges, end exclusive.
+    ranges = []
+    for address in sorted(addresses):
+        if ranges and (ranges[-1][1] == address):
+            ranges[-1] = (ranges[-1][0], address + 1)
+        else:
+            ranges.append((address, address + 1))
+    return ranges
+
+
+def disassemble(memory: List[int]) -> Disassembly:
+    instructions = {}
+    invalid = set()
+    constants = set()
+    after_jumps = set()
+    pending = [0]
+    while pending:
+        address = pending.pop()
+        if (address not in instructions) and (address not in invalid):
+            instruction = decode_instruction(memory, address)
+            if instruction is None:
+                invalid.add(address)
+            else:
+                instructions[address] = instruction
+                following, indirect = successors(instruction)
+                pending.extend(following)
+                if stored_constant(instruction) is not None:
+                    constants.add(stored_constant(instruction))
+                after = address + 1 + len(instruction.parameters)
+                if (instruction.opcode in [5, 6]) and (after not in following):
+                    after_jumps.add(after)
+        if not pending:
+            returns = (constants & after_jumps) - set(instructions) - invalid
+            pending.extend(returns)
+
+    leaders = {0} | (constants & after_jumps)
+    for instruction in instructions.values():
+        if instruction.opcode in [5, 6, 99]:
+            leaders.update(successors(instruction)[0])
+            leaders.add(instruction.address + 1 + len(instruction.parameters))
+    leaders &= set(instructions)
+    blocks = {}
+    for start in sorted(leaders):
+        address = start
+        while True:
+            instruction = instructions[address]
+            following, indirect = successors(instruction)
+            end = address + 1 + len(instruction.parameters)
+            if (following != [end]) or (end in leaders) or (end not in instructions):
+                break
+            address = end
+        blocks[start] = Block(start, end, following, indirect)
+
+    code = set()
+    code_writes = []
+    relative_writes = []
+    for instruction in instructions.values():
+        end = instruction.address + 1 + len(instruction.parameters)
+        code.update(range(instruction.address, min(end, len(memory))))
+    for address, instruction in sorted(instructions.items()):
+        if instruction.opcode in writing_opcodes:
+            if instruction.modes[-1] == 2:
+                relative_writes.append(address)
+            elif instruction.parameters[-1] in code:
+                code_writes.append(address)
+    return Disassembly(
+        instructions=instructions,
+        blocks=blocks,
+        code=address_ranges(code),
+        data=address_ranges(set(range(len(memory))) - code),
+        code_writes=code_writes,
+        relative_writes=relative_writes,
+        invalid=sorted(invalid),
+    )
+
+
+def summarise(disassembly: Disassembly) -> Dict[str, list]:
+    # The disassembly in plain lists and dicts, for json.
+    sites = {3: [], 4: []}
+    for address, instruction in sorted(disassembly.instructions.items()):
+        if instruction.opcode in sites:
+            sites[instruction.opcode].append(address)
+    return {
+        "blocks": [block._asdict() for block in disassembly.blocks.values()],
+        "code": disassembly.code,
+        "data": disassembly.data,
+        "inputs": sites[3],
+        "outputs": sites[4],
+        "code_writes": disassembly.code_writes,
+        "relative_writes": disassembly.relative_writes,
+        "invalid": disassembly.invalid,
+    }
+
+
+#################### OPTIMISER ############################
+# optimise rewrites a program ahead of time without moving anything: programs
+# address their data absolutely and compute addresses at run time, so every
+# address has to keep its meaning, and code that is never reached can not be
+# told apart from data. Parameters of reachable instructions that read a cell
+# no instruction ever writes become immediates, which turns some conditional
+# jumps into jumps that are always or never taken. Jumps to such jumps are
+# then threaded to where those end up, which saves executing them. A program
+# that writes into its own code is left as it is, and so is one that reads or
+# writes relative to the relative base unless its stack provably starts after
+# the program: every path from address 0 has to set the relative base with a
+# 109 past the end before anything else uses it, and all other adjustments
+# have to be immediates as well. Like calls that pop what they push, these
+# never take it back below where the first one put it.
+
+
+class Optimised(NamedTuple):
+    memory: List[int]
+    # The original words of every rewritten instruction, by address.
+    original: Dict[int, List[int]]
+
+
+def absolute_cells(memory: List[int]) -> (set, set):
+    # The addresses that instructions anywhere in memory (reachable or not, to
+    # be safe) read and write in position mode.
+    read = set()
+    written = set()
+    for address in range(len(memory)):
+        instruction = decode_instruction(memory, address)
+        if instruction is None:
+            continue
+        for index, (mode, parameter) in enumerate(
+            zip(instruction.modes, instruction.parameters)
+        ):
+            if mode != 0:
+                continue
+            if (instruction.opcode in writing_opcodes) and (
+                index == len(instruction.parameters) - 1
+            ):
+                written.add(parameter)
+            else:
+                read.add(parameter)
+    return read, written
+
+
+def stack_after_program(memory: List[int], disassembly: Disassembly) -> bool:
+    # Whether everything the reachable code reads or writes relative to the
+    # relative base lies after the program, as described above. Also true for
+    # programs that never use the relative base.
+    relative = False
+    for instruction in disassembly.instructions.values():
+        if (instruction.opcode == 9) and (instruction.modes[0] != 1):
+            return False
+        relative = relative or (2 in instruction.modes)
+    if not relative:
+        return True
+    seen = set()
+    pending = [0]
+    while pending:
+        address = pending.pop()
+        if address in seen:
+            continue
+        seen.add(address)
+        instruction = decode_instruction(memory, address)
+        if instruction is None:
+            return False
+        if instruction.opcode == 9:
+            if instruction.parameters[0] < len(memory):
+                return False
+            continue
+        following, indirect = successors(instruction)
+        if indirect or (2 in instruction.modes):
+            return False
+        pending.extend(following)
+    return True
+
+
+def encode_instruction(instruction: Instruction) -> List[int]:
+    value = instruction.opcode
+    for index, mode in enumerate(instruction.modes):
+        value += mode * 10 ** (index + 2)
+    return [value] + instruction.parameters
+
+
+def fold_constants(
+    memory: List[int], instruction: Instruction, constant: set
+) -> Instruction:
+    modes = list(instruction.modes)
+    parameters = list(instruction.parameters)
+    reads = len(parameters) - (instruction.opcode in writing_opcodes)
+    for index in range(reads):
+        if (modes[index] == 0) and (parameters[index] in constant):
+            modes[index] = 1
+            parameters[index] = memory[parameters[index]]
+    return instruction._replace(modes=modes, parameters=parameters)
+
+
+def thread_jump(instructions: Dict[int, Instruction], target: int) -> int:
+    # Follows jumps that are always taken and skips jumps that never are.
+    seen = set()
+    while (target in instructions) and (target not in seen):
+        seen.add(target)
+        jump = instructions[target]
+        if (jump.opcode not in [5, 6]) or (jump.modes[0] != 1):
+            break
+        if (jump.parameters[0] != 0) != (jump.opcode == 5):
+            target += 3
+        elif jump.modes[1] == 1:
+            target = jump.parameters[1]
+        else:
+            break
+    return target
+
+
+def optimise(memory: List[int]) -> Optimised:
+    disassembly = disassemble(memory)
+    # Neither which cells stay the same nor what the instructions do is known
+    # then.
+    if disassembly.code_writes or not stack_after_program(memory, disassembly):
+        return Optimised(list(memory), {})
+    read, written = absolute_cells(memory)
+    code = set()
+    for start, end in disassembly.code:
+        code.update(range(start, end))
+    # Cells that hold the same value for the whole run, and are not part of
+    # an instruction that gets rewritten here.
+    constant = set(range(len(memory))) - written - code
+    # Instructions that are never written or read as data, and that do not
+    # overlap another instruction, can be rewritten.
+    overlapping = set()
+    for address, instruction in disassembly.instructions.items():
+        for other in range(address + 1, address + 1 + len(instruction.parameters)):
+            if other in disassembly.instructions:
+                overlapping.update([address, other])
+    instructions = {}
+    for address, instruction in disassembly.instructions.items():
+        cells = set(range(address, address + 1 + len(instruction.parameters)))
+        if (
+            (address not in overlapping)
+            and (max(cells) < len(memory))
+            and not cells & (read | written)
+        ):
+            instructions[address] = fold_constants(memory, instruction, constant)
+    for address, instruction in instructions.items():
+        if (instruction.opcode in [5, 6]) and (instruction.modes[1] == 1):
+            target = thread_jump(instructions, instruction.parameters[1])
+            instruction.parameters[1] = target
+
+    optimised = list(memory)
+    original = {}
+    for address, instruction in sorted(instructions.items()):
+        words = encode_instruction(instruction)
+        end = address + len(words)
+        if words != memory[address:end]:
+            original[address] = memory[address:end]
+            optimised[address:end] = words
+    return Optimised(optimised, original)
+
+
+#################### COUNTING LOOPS ############################
+# run_accelerated is a drop-in replacement for
+# continue_program_till_no_input_or_halt that runs counting loops in closed
+# form. When a conditional jump goes back to an earlier address, the
+# instructions from there up to the jump are checked: if they only add
+# constants to cells, compare one of these counters with a constant into a
+# flag and end in the jump on that flag, the number of iterations left is
+# computed and every cell is updated at once. Everything else, including
+# loops that never end, is left to the interpreter.
+
+
+class CountingLoop(NamedTuple):
+    # (cell, address of the value added to it) for every add, in order.
+    adds: List[Tuple[int, int]]
+    # How many of the adds come before the compare.
+    compare_at: int
+    compare_opcode: int
+    counter: int
+    # The address of the value the counter is compared with.
+    bound: int
+    counter_first: bool
+    flag: int
+    jump_opcode: int
+
+
+# The words of analysed loops and the loop found in them (or None), keyed by
+# start, jump and relative base, which together with the words are all the
+# analysis depends on.
+counting_loops = {}
+
+
+def resolve_parameter(
+    array: List[int], address: int, mode: int, relative_base: int
+) -> int:
+    if mode == 0:
+        return array[address]
+    if mode == 2:
+        return array[address] + relative_base
+    return address
+
+
+def analyse_loop(
+    array: List[int], start: int, jump: int, relative_base: int
+) -> CountingLoop:
+    adds = []
+    compare = None
+    address = start
+    try:
+        while address < jump:
+            opcode, modes = parse_modes(array[address])
+            if opcode not in [1, 7, 8]:
+                return None
+            first, second, third = [
+                resolve_parameter(array, address + offset, mode, relative_base)
+                for offset, mode in enumerate(modes[:3], 1)
+            ]
+            if (opcode == 1) and (third == first):
+                adds.append((third, second))
+            elif (opcode == 1) and (third == second):
+                adds.append((third, first))
+            elif (opcode != 1) and (compare is None):
+                compare = len(adds), opcode, first, second, third
+            else:
+                return None
+            address += 4
+        opcode, modes = parse_modes(array[jump])
+        condition = resolve_parameter(array, jump + 1, modes[0], relative_base)
+        target = resolve_parameter(array, jump + 2, modes[1], relative_base)
+    except (IndexError, ValueError):
+        return None
+    if (address != jump) or (compare is None) or (opcode not in [5, 6]):
+        return None
+    compare_at, compare_opcode, first, second, flag = compare
+    counters = {cell for cell, _ in adds}
+    written = counters | {flag}
+    sources = {source for _, source in adds}
+    bound = second if first in counters else first
+    if (
+        ((first in counters) == (second in counters))
+        or (flag in counters)
+        or (condition != flag)
+        or (written & (sources | {bound, target}))
+        or (written & set(range(start, jump + 3)))
+        or min(written | sources | {bound, target}) < 0
+    ):
+        return None
+    return CountingLoop(
+        adds=adds,
+        compare_at=compare_at,
+        compare_opcode=compare_opcode,
+        counter=first if first in counters else second,
+        bound=bound,
+        counter_first=first in counters,
+        flag=flag,
+        jump_opcode=opcode,
+    )
+
+
+def first_iteration(value: int, step: int, bound: int, relation: str) -> int:
+    # The first j >= 0 for which value + j * step relates to bound as given,
+    # None if there is none.
+    if relation == "<=":
+        if value <= bound:
+            return 0
+        return -((value - bound) // step) if step < 0 else None
+    if relation == ">=":
+        if value >= bound:
+            return 0
+        return -((value - bound) // step) if step > 0 else None
+    if relation == "==":
+        if value == bound:
+            return 0
+        if (step != 0) and ((bound - value) % step == 0):
+            iterations = (bound - value) // step
+            return iterations if iterations > 0 else None
+        return None
+    if value != bound:
+        return 0
+    return 1 if step != 0 else None
+
+
+def run_counting_loop(array: List[int], loop: CountingLoop) -> bool:
+    # Runs the loop to the iteration its jump falls through in, if it ever
+    # does and all its cells exist, starting at its first instruction.
+    cells = [cell for add in loop.adds for cell in add]
+    if max(cells + [loop.counter, loop.bound, loop.flag]) >= len(array):
+        return False
+    increments = {}
+    for cell, source in loop.adds:
+        increments[cell] = increments.get(cell, 0) + array[source]
+    value = array[loop.counter] + sum(
+        array[source]
+        for cell, source in loop.adds[: loop.compare_at]
+        if cell == loop.counter
+    )
+    bound = array[loop.bound]
+    # The loop ends with the first compare that sets the flag to stop.
+    stop = 1 if loop.jump_opcode == 6 else 0
+    if loop.compare_opcode == 8:
+        relation = "==" if stop else "!="
+    elif loop.counter_first:
+        relation, bound = ("<=", bound - 1) if stop else (">=", bound)
+    else:
+        relation, bound = (">=", bound + 1) if stop else ("<=", bound)
+    last = first_iteration(value, increments[loop.counter], bound, relation)
+    if last is None:
+        return False
+    for cell, increment in increments.items():
+        array[cell] += (last + 1) * increment
+    array[loop.flag] = stop
+    return True
+
+
+def run_accelerated(program: Program, last_step: int) -> (Program, int):
+    if last_step == 99:
+        return program, last_step
+    if getattr(program, "shared_memory", False) or not isinstance(program.array, list):
+        program.array = list(program.array)
+        program.shared_memory = False
+    array = program.array
+    inputs = program.inputs
+    output = program.output
+    pointer = program.pointer
+    relative_base = program.relative_base
+    while True:
+        try:
+            opcode, modes = parse_modes(array[pointer])
+            if opcode == 99:
+                last_step = 99
+                break
+            if (opcode == 3) and not inputs:
+                last_step = -1
+                break
+
+            first = pointer + 1
+            if modes[0] == 0:
+                first = array[first]
+            elif modes[0] == 2:
+                first = array[first] + relative_base
+            if opcode == 3:
+                array[first] = inputs[0]
+                inputs.popleft()
+                pointer += 2
+                continue
+            if opcode == 4:
+                output.append(array[first])
+                pointer += 2
+                continue
+            if opcode == 9:
+                relative_base += array[first]
+                pointer += 2
+                continue
+
+            second = pointer + 2
+            if modes[1] == 0:
+                second = array[second]
+            elif modes[1] == 2:
+                second = array[second] + relative_base
+            if (opcode == 5) or (opcode == 6):
+                if (array[first] != 0) == (opcode == 6):
+                    pointer += 3
+                    continue
+                target = array[second]
+                if target < pointer:
+                    key = target, pointer, relative_base
+                    words = array[target : pointer + 3]
+                    cached = counting_loops.get(key)
+                    if (cached is None) or (cached[0] != words):
+                        loop = analyse_loop(array, target, pointer, relative_base)
+                        cached = counting_loops[key] = words, loop
+                    loop = cached[1]
+                    if (loop is not None) and run_counting_loop(array, loop):
+                        pointer += 3
+                        continue
+                pointer = target
+                continue
+
+            third = pointer + 3
+            if modes[2] == 0:
+                third = array[third]
+            elif modes[2] == 2:
+                third = array[third] + relative_base
+            if opcode == 1:
+                array[third] = array[first] + array[second]
+            elif opcode == 2:
+                array[third] = array[first] * array[second]
+            elif opcode == 7:
+                array[third] = 1 if array[first] < array[second] else 0
+            else:
+                array[third] = 1 if array[first] == array[second] else 0
+            pointer += 4
+        except IndexError:
+            grow_memory(array, pointer, relative_base)
+    program.pointer = pointer
+    program.relative_base = relative_base
+    return program, last_step
+
+
+#################### SCHEDULER ############################
+# A Scheduler owns a number of programs and runs only those that can make
+# progress: programs with input, and programs that poll with an idle_input
+# (like the -1 of day 23) until poll_input parks them. A poller that sent
+# nothing on its last poll and has no input is idle. Each gets time_slice
+# runs (up to its next wait for input) per turn. The output of a program goes
+# through its Channel, which cuts it into packets of width words and delivers
+# every packet to the target program, or, without a target, to the program
+# whose index is the first word of the packet. run() yields an Event for
+# packets to addresses that are not a program, and when nothing can run any
+# more: "halted" once all programs halted, "idle" as soon as all others are
+# idle pollers (parked or not) and "deadlock" when some wait for input that
+# nobody sends. Input sent in response (see send) keeps the run going,
+# otherwise it ends.
+
+
+class Channel:
+    def __init__(self, width: int = 1, target: int = None):
+        self.width = width
+        self.target = target
+        self.words = deque()
+        # The last packet delivered.
+        self.last = None
+
+
+class Event(NamedTuple):
+    kind: str
+    source: int = None
+    packet: List[int] = None
+
+
+class Scheduler:
+    def __init__(self, time_slice: int = 1):
+        self.time_slice = time_slice
+        self.programs = []
+        self.channels = []
+        self.idle_inputs = []
+        self.last_steps = []
+        self.parked = []
+        self.idle = set()
+        self.halted = set()
+        self.ready = deque()
+        self.queued = set()
+        # Events of the current turn, handed out by run after it.
+        self.events = []
+
+    def add(self, program: Program, idle_input: int = None) -> int:
+        index = len(self.programs)
+        self.programs.append(program)
+        self.channels.append(None)
+        self.idle_inputs.append(idle_input)
+        self.last_steps.append(0)
+        self.parked.append(False)
+        self.wake(index)
+        return index
+
+    def connect(self, source: int, channel: Channel) -> Channel:
+        self.channels[source] = channel
+        return channel
+
+    def wake(self, index: int) -> None:
+        if (index not in self.queued) and (self.last_steps[index] != 99):
+            self.ready.append(index)
+            self.queued.add(index)
+
+    def send(self, target: int, words: List[int]) -> None:
+        self.programs[target].extend_inputs(words)
+        self.parked[target] = False
+        self.idle.discard(target)
+        self.wake(target)
+
+    def is_idle(self) -> bool:
+        return bool(self.idle) and (
+            len(self.idle) + len(self.halted) == len(self.programs)
+        )
+
+    def deliver(self, source: int) -> None:
+        channel = self.channels[source]
+        if (channel is None) or not self.programs[source].output:
+            # Without a channel the output stays with the program.
+            return
+        output = self.programs[source].drain_output()
+        if (channel.width == 1) and (channel.target is not None):
+            channel.last = output[-1:]
+            self.send(channel.target, output)
+            return
+        channel.words.extend(output)
+        while len(channel.words) >= channel.width:
+            packet = [channel.words.popleft() for _ in range(channel.width)]
+            if channel.target is not None:
+                target, words = channel.target, packet
+            else:
+                target, words = packet[0], packet[1:]
+            channel.last = packet
+            if 0 <= target < len(self.programs):
+                self.send(target, words)
+            else:
+                self.events.append(Event("packet", source, packet))
+
+    def run_turn(self, index: int) -> None:
+        program = self.programs[index]
+        idle_input = self.idle_inputs[index]
+        for _ in range(self.time_slice):
+            last_step = self.last_steps[index]
+            written = len(program.output)
+            polled = not (program.inputs or (last_step == 0) or (idle_input is None))
+            if polled:
+                program, last_step, parked = poll_input(program, last_step, idle_input)
+            else:
+                program, last_step = continue_program_till_no_input_or_halt(
+                    program, last_step
+                )
+                parked = False
+            self.programs[index] = program
+            self.last_steps[index] = last_step
+            self.parked[index] = parked
+            if last_step == 99:
+                self.halted.add(index)
+                self.idle.discard(index)
+            elif polled and (len(program.output) == written):
+                self.idle.add(index)
+            else:
+                self.idle.discard(index)
+            self.deliver(index)
+            if (last_step == 99) or parked:
+                break
+            if (idle_input is None) and not program.inputs:
+                break
+        if (idle_input is not None) and not self.parked[index]:
+            self.wake(index)
+
+    def run(self) -> Iterator[Event]:
+        while True:
+            while self.ready:
+                index = self.ready.popleft()
+                self.queued.discard(index)
+                self.run_turn(index)
+                if self.events:
+                    events, self.events = self.events, []
+                    yield from events
+                # Pollers that are not parked stay ready, so whether all are
+                # idle is checked after every turn.
+                if self.is_idle():
+                    yield Event("idle")
+                    if self.is_idle():
+                        return
+            waiting = [
+                index
+                for index, last_step in enumerate(self.last_steps)
+                if last_step != 99
+            ]
+            if not waiting:
+                yield Event("halted")
+                return
+            yield Event("deadlock")
+            if not self.ready:
+                return
+
+
+#################### DAYS ############################
+# solve_day runs part 1 or 2 of a day module like the day's own __main__
+# does, for --day. Days that print their results themselves return None.
+
+
+def solve_day(day, part: int, puzzle_input: List[int]):
+    name = day.__name__
+    if name == "day09":
+        return day.run_program(list(puzzle_input), [part]).output
+    if name == "day11":
+        return day.solve(puzzle_input)
+    if name == "day13":
+        if part == 1:
+            return day.solve(puzzle_input)
+        # Playing for free, see day13.py.
+        return day.solve_2([2] + puzzle_input[1:])
+    if name == "day15":
+        board = day.solve_1(puzzle_input)
+        return None if part == 1 else day.solve_2(board)
+    if name == "day17":
+        board, alignment = day.solve_1(puzzle_input)
+        if part == 1:
+            return alignment
+        return day.solve_2([2] + puzzle_input[1:], board)
+    solve = day.solve_2 if part == 2 else day.solve_1
+    return solve(puzzle_input)
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    if arguments and (arguments[0] == "--replay"):
+        memory = memory_at(arguments[1], int(arguments[2]))
+        print("Memory:", ",".join(str(value) for value in memory))
+        sys.exit()
+    run = continue_program_till_no_input_or_halt
+    profile = None
+    recorder = None
+    session = None
+    if arguments and (arguments[0] == "--compiled"):
+        run = run_compiled
+        arguments = arguments[1:]
+    elif arguments and (arguments[0] == "--accelerated"):
+        run = run_accelerated
+        arguments = arguments[1:]
+    elif arguments and (arguments[0] == "--fused"):
+        run = run_fused
+        arguments = arguments[1:]
+    elif arguments and (arguments[0] == "--profile"):
+        profile = Profile()
+        run = profile.run
+        arguments = arguments[1:]
+    elif arguments and (arguments[0] == "--watch"):
+        # Prints every read and write of the addresses from start to end.
+        watchpoints = Watchpoints()
+        watchpoints.watch(
+            int(arguments[1]),
+            int(arguments[2]),
+            on_read=lambda address, value: print(f"Read {address}: {value}"),
+            on_write=lambda address, old, new: print(
+                f"Write {address}: {old} -> {new}"
+            ),
+        )
+        run = watchpoints.run
+        arguments = arguments[3:]
+    elif arguments and (arguments[0] == "--trace"):
+        recorder = TraceRecorder(arguments[1], every=int(arguments[2]))
+        run = recorder.run
+        arguments = arguments[3:]
+    elif arguments and (arguments[0] == "--record"):
+        # Records the session to a file for --replay-session.
+        session = SessionRecorder()
+        run = session.run
+        session_path = arguments[1]
+        arguments = arguments[2:]
+    elif arguments and (arguments[0] == "--checkpoint"):
+        # Checkpoints to path every time the program waits for input or
+        # halts, at most every given number of seconds.
+        run = Checkpoints(arguments[1], float(arguments[2])).run
+        arguments = arguments[3:]
+    if arguments and (arguments[0] == "--resume"):
+        # python intcode.py --resume input.ckpt 1 2 carries on from a
+        # checkpoint with 1 and 2 queued as further inputs.
+        puzzle_input = []
+    elif arguments and (arguments[0] == "--replay-session"):
+        # python intcode.py --fused --replay-session day13.session times the
+        # recorded session without the day's controller.
+        seconds, matched = replay_session(arguments[1], run)
+        print(f"Replayed in {seconds:.3f}s,", "outputs match:", matched)
+        sys.exit()
+    else:
+        puzzle_input = read_program(sys.stdin.buffer.read())
+    if arguments and (arguments[0] == "--save-image"):
+        # python intcode.py --save-image input.img < input
+        save_image(puzzle_input, arguments[1])
+    elif arguments and (arguments[0] == "--disassemble"):
+        # Prints blocks, code and data ranges, I/O sites and self-modifying
+        # writes as json.
+        print(json.dumps(summarise(disassemble(puzzle_input)), indent=1))
+    elif arguments and (arguments[0] == "--optimise"):
+        # python intcode.py --optimise optimised.img < input
+        optimised = optimise(puzzle_input)
+        save_image(optimised.memory, arguments[1])
+        print("Rewritten instructions:", len(optimised.original))
+    elif arguments and (arguments[0] == "--many"):
+        # python intcode.py --many 4 1,2 3,4 < input runs one job per list.
+        jobs = [[int(x) for x in job.split(",")] for job in arguments[2:]]
+        for index, program in run_many(puzzle_input, jobs, int(arguments[1])):
+            print(f"Output {index}:", program.output)
+    elif arguments and (arguments[0] == "--resume"):
+        program = initiate_program(puzzle_input, [])
+        program.restore_checkpoint(arguments[1])
+        program.extend_inputs([int(x) for x in arguments[2:]])
+        program, last_step = run(program, 0)
+        print("Output:", program.output)
+    elif arguments and (arguments[0] == "--day"):
+        # Runs part 1 (or 2) of a day with its interpreter swapped for run.
+        day = importlib.import_module(arguments[1])
+        if not hasattr(day, "continue_program_till_no_input_or_halt"):
+            # Days 2, 5 and 7 run their own loops, which can not be swapped.
+            sys.exit(f"--day needs a day from 9 on, not {arguments[1]}")
+        day.continue_program_till_no_input_or_halt = run
+        result = solve_day(day, 2 if arguments[2:] == ["2"] else 1, puzzle_input)
+        if result is not None:
+            print("Result:", result)
+    else:
+        program = initiate_program(puzzle_input, [int(x) for x in arguments])
+        program, last_step = run(program, 0)
+        print("Output:", program.output)
+    if run is run_fused:
+        # With --day, these are the totals over every program the day ran.
+        instructions = fusion_totals["instructions"]
+        dispatches = fusion_totals["dispatches"]
+        saved = 100 * (instructions - dispatches) / max(instructions, 1)
+        print(
+            f"Instructions: {instructions}, dispatches: {dispatches}",
+            f"({saved:.1f}% fewer)",
+        )
+    if profile is not None:
+        print(profile.report())
+    if recorder is not None:
+        recorder.close()
+    if session is not None:
+        session.save(session_path)